@@ -1,5 +1,6 @@
 from django.contrib import admin
 from django import forms
+from django.utils.text import Truncator
 
 from mapstory.models import Sponsor
 from mapstory.models import NewsItem
@@ -7,12 +8,50 @@ from mapstory.models import DiaryEntry
 from mapstory.models import GetPage
 from mapstory.models import GetPageContent
 from mapstory.models import Leader
+from mapstory.models import plain_text
+from mapstory import cache
+from mapstory.jobs import Job
+from mapstory.jobs import enqueue_batches
 
 
-def content_html(obj):
-    return obj.html()
-content_html.allow_tags = True
-content_html.short_description = 'Content'
+PREVIEW_LENGTH = 200
+
+
+def content_preview(obj):
+    # the stored rendering, even if stale, rather than textile for every row
+    text = plain_text(obj.html_cache).strip() if obj.html_cache else obj.content
+    return Truncator(text).chars(PREVIEW_LENGTH)
+content_preview.short_description = 'Content'
+
+
+def _enqueue_action(fun, description, with_label=True):
+    '''an admin action queueing fun over the selected rows'''
+    def action(modeladmin, request, queryset):
+        args = ('%s.%s' % (queryset.model._meta.app_label,
+                           queryset.model._meta.model_name),) if with_label else ()
+        queued = enqueue_batches(fun, queryset.values_list('pk', flat=True), *args)
+        modeladmin.message_user(request, 'Queued %d jobs' % len(queued))
+    action.__name__ = fun.rsplit('.', 1)[1]
+    action.short_description = description
+    return action
+
+
+rerender_textile = _enqueue_action('mapstory.tasks.rerender_textile',
+                                   'Re-render the textile of the selected rows')
+reindex_content = _enqueue_action('mapstory.tasks.index_content',
+                                  'Update the search index of the selected rows')
+restamp_sponsors = _enqueue_action('mapstory.tasks.restamp_sponsors',
+                                   'Restamp the selected icons', with_label=False)
+make_sponsor_thumbnails = _enqueue_action('mapstory.tasks.make_sponsor_thumbnails',
+                                          'Make the thumbnails of the selected icons',
+                                          with_label=False)
+
+
+def requeue_jobs(modeladmin, request, queryset):
+    requeued = queryset.exclude(status=Job.QUEUED).update(
+        status=Job.QUEUED, started=None, finished=None, error='')
+    modeladmin.message_user(request, 'Requeued %d jobs' % requeued)
+requeue_jobs.short_description = 'Requeue the selected jobs'
 
 
 class GetPageAdmin(admin.ModelAdmin):
@@ -22,11 +61,35 @@ class GetPageAdmin(admin.ModelAdmin):
     list_display_links = 'name',
 
 
+def getpage_choices():
+    '''(pk, title) of every GetPage, shared by all forms until one changes'''
+    return cache.get_or_build(
+        'getpages:choices', lambda: list(GetPage.objects.values_list('pk', 'title')))
+
+
+class GetPageChoiceIterator(forms.models.ModelChoiceIterator):
+    '''the choices of GetPageChoiceField, only looked up when iterated'''
+
+    def __iter__(self):
+        if self.field.empty_label is not None:
+            yield ('', self.field.empty_label)
+        for choice in getpage_choices():
+            yield choice
+
+    def __len__(self):
+        return len(getpage_choices()) + (1 if self.field.empty_label is not None else 0)
+
+
 class GetPageChoiceField(forms.ModelChoiceField):
     def __init__(self):
         super(GetPageChoiceField, self).__init__(GetPage.objects.all())
     def label_from_instance(self, obj):
         return obj.title
+    def _get_choices(self):
+        if hasattr(self, '_choices'):
+            return self._choices
+        return GetPageChoiceIterator(self)
+    choices = property(_get_choices, forms.ChoiceField._set_choices)
 
 
 class GetPageContentForm(forms.ModelForm):
@@ -39,8 +102,10 @@ class GetPageContentAdmin(admin.ModelAdmin):
     model = GetPageContent
     form = GetPageContentForm
     list_display = 'title', 'subtitle', 'page', 'order', 'date', 'publish'
+    list_select_related = 'page',
     list_editable = 'subtitle', 'order', 'publish'
     list_display_links = 'title',
+    actions = rerender_textile, reindex_content
 
 
 class SponsorAdmin(admin.ModelAdmin):
@@ -49,6 +114,7 @@ class SponsorAdmin(admin.ModelAdmin):
     list_display = 'name', 'link', 'icon', 'image_tag', 'description', 'order'
     list_editable = 'name', 'link', 'icon', 'description', 'order'
     list_display_links = 'image_tag',
+    actions = restamp_sponsors, make_sponsor_thumbnails
 
 
 class NewsItemForm(forms.ModelForm):
@@ -61,20 +127,33 @@ class NewsItemForm(forms.ModelForm):
 
 class NewsItemAdmin(admin.ModelAdmin):
     model = NewsItem
-    list_display = 'title', 'publication_time', content_html
+    list_display = 'title', 'publication_time', content_preview
     exclude = 'publish',
     form = NewsItemForm
+    actions = rerender_textile, reindex_content
 
 
 class DiaryEntryAdmin(admin.ModelAdmin):
     model = DiaryEntry
     list_display = 'title', 'author', 'publish', 'date'
+    list_select_related = 'author',
     list_editable = 'publish',
+    actions = rerender_textile, reindex_content
 
 
 class LeaderAdmin(admin.ModelAdmin):
     model = Leader
     list_display = 'user',
+    list_select_related = 'user',
+    actions = rerender_textile,
+
+
+class JobAdmin(admin.ModelAdmin):
+    model = Job
+    list_display = 'name', 'args', 'status', 'created', 'started', 'finished'
+    list_filter = 'status',
+    readonly_fields = 'name', 'args', 'created', 'started', 'finished', 'error'
+    actions = requeue_jobs,
 
 
 admin.site.register(GetPage, GetPageAdmin)
@@ -83,3 +162,4 @@ admin.site.register(Sponsor, SponsorAdmin)
 admin.site.register(NewsItem, NewsItemAdmin)
 admin.site.register(DiaryEntry, DiaryEntryAdmin)
 admin.site.register(Leader, LeaderAdmin)
+admin.site.register(Job, JobAdmin)
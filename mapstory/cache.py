@@ -0,0 +1,94 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.core.cache.backends.locmem import LocMemCache
+import random
+import time
+import warnings
+
+
+TIMEOUT = getattr(settings, 'MAPSTORY_CACHE_TIMEOUT', 300)
+# the share of lookups counted in the statistics
+STATS_SAMPLE = getattr(settings, 'MAPSTORY_CACHE_STATS_SAMPLE', 0.01)
+
+_PREFIX = 'mapstory:'
+_STATS_PREFIX = _PREFIX + 'stats:'
+_STATS_NAMES = _PREFIX + 'stats'
+_STATS_TIMEOUT = 60 * 60 * 24
+_GROUP_PREFIX = _PREFIX + 'group:'
+_registered = set()
+
+
+if isinstance(cache, LocMemCache) and not settings.DEBUG:
+    # invalidations and statistics would not reach the other processes
+    warnings.warn('the default cache is local to each process, configure a '
+                  'shared one in CACHES', RuntimeWarning)
+
+
+def _count(name, outcome):
+    if random.random() >= STATS_SAMPLE:
+        return
+    key = '%s%s:%s' % (_STATS_PREFIX, name, outcome)
+    # counters live in the shared cache so every worker reports into the
+    # same place
+    try:
+        cache.incr(key)
+    except ValueError:
+        # the first count, or the backend does not keep anything (DummyCache)
+        cache.add(key, 1, _STATS_TIMEOUT)
+    if name not in _registered:
+        names = cache.get(_STATS_NAMES) or set()
+        cache.set(_STATS_NAMES, names | set([name]), _STATS_TIMEOUT)
+        _registered.add(name)
+
+
+def group_version(group):
+    '''a value that changes whenever group is invalidated'''
+    key = _GROUP_PREFIX + group
+    version = cache.get(key)
+    if version is None:
+        # versions are timestamps so a group whose version was evicted never
+        # comes back to an older one and finds stale entries
+        cache.add(key, repr(time.time()), None)
+        version = cache.get(key)
+    return version
+
+
+def get_or_build(name, build, timeout=None, group=None):
+    '''Return the cached value for name, calling build() on a miss. build may
+    return a (value, timeout) tuple to override the timeout. Names in a group
+    are invalidated together with invalidate_group.'''
+    key = _PREFIX + name
+    if group is not None:
+        key = '%s%s@%s:%s' % (_PREFIX, group, group_version(group), name)
+    value = cache.get(key)
+    if value is not None:
+        _count(name, 'hit')
+        return value
+    _count(name, 'miss')
+    value = build()
+    if isinstance(value, tuple):
+        value, timeout = value
+    cache.set(key, value, TIMEOUT if timeout is None else timeout)
+    return value
+
+
+def invalidate(*names):
+    cache.delete_many([_PREFIX + name for name in names])
+
+
+def invalidate_group(*groups):
+    version = repr(time.time())
+    cache.set_many(dict((_GROUP_PREFIX + group, version) for group in groups), None)
+
+
+def stats():
+    '''{name: {'hit': n, 'miss': n}} for every cached name seen so far,
+    estimated from the sampled lookups'''
+    result = {}
+    for name in cache.get(_STATS_NAMES) or ():
+        result[name] = dict(
+            (outcome, int((cache.get('%s%s:%s' % (_STATS_PREFIX, name, outcome)) or 0)
+                          / STATS_SAMPLE))
+            for outcome in ('hit', 'miss')
+        )
+    return result
@@ -1,13 +1,58 @@
+'''
+Template globals, computed once per process rather than on every render.
+
+The context processor hands out the same dict, computed on first use, to
+every request and remote_content_url memoizes the URL of every asset path.
+reset() makes them follow changed settings (in tests).
+'''
 from django.conf import settings
+from django.contrib.staticfiles.storage import staticfiles_storage
+
+
+_context = None
+_remote_urls = {}
+
+
+def _build():
+    live_reload = getattr(settings, 'LIVE_RELOAD', False)
+    if live_reload is True:
+        live_reload = 'localhost'
+    return dict(
+        LIVE_RELOAD=live_reload,
+        LOCAL_CONTENT=getattr(settings, 'LOCAL_CONTENT', False),
+        REMOTE_CONTENT_URL=getattr(settings, 'REMOTE_CONTENT_URL', ''),
+    )
+
+
+def _globals():
+    global _context
+    if _context is None:
+        _context = _build()
+    return _context
+
+
+def reset():
+    '''recompute the globals on their next use'''
+    global _context
+    _context = None
+    _remote_urls.clear()
 
 
-LIVE_RELOAD = getattr(settings, 'LIVE_RELOAD', False)
-if LIVE_RELOAD is True:
-    LIVE_RELOAD = 'localhost'
+def remote_content_url(path):
+    try:
+        return _remote_urls[path]
+    except KeyError:
+        pass
+    url = None
+    if _globals()['LOCAL_CONTENT'] and not settings.DEBUG:
+        # collected local assets are served by their hashed names
+        manifest_url = getattr(staticfiles_storage, 'manifest_url', None)
+        if manifest_url is not None:
+            url = manifest_url('assets/%s' % path)
+    if url is None:
+        url = '%s/%s' % (_globals()['REMOTE_CONTENT_URL'], path)
+    return _remote_urls.setdefault(path, url)
 
-_context = dict(
-    LIVE_RELOAD=LIVE_RELOAD
-)
 
 def context(req):
-    return _context
\ No newline at end of file
+    return _globals()
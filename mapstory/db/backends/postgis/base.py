@@ -0,0 +1,7 @@
+from django.contrib.gis.db.backends.postgis.base import *
+from django.contrib.gis.db.backends.postgis.base import DatabaseWrapper as PostGISDatabaseWrapper
+from mapstory.db.pool import PooledDatabaseWrapperMixin
+
+
+class DatabaseWrapper(PooledDatabaseWrapperMixin, PostGISDatabaseWrapper):
+    pass
@@ -0,0 +1,213 @@
+'''
+A process wide pool of raw database connections per alias, used by the
+backends in mapstory.db.backends.
+
+Configure it with a POOL entry in the DATABASES alias:
+
+    'POOL': {
+        'SIZE': 5,                    # connections kept open
+        'MAX_OVERFLOW': 5,            # extra connections opened under load
+        'MAX_AGE': 600,               # seconds before a connection is replaced
+        'TIMEOUT': 10,                # seconds to wait for a free connection
+        'HEALTH_CHECK_INTERVAL': 30,  # idle seconds before a SELECT 1 check
+    }
+'''
+from django.db import connections
+import logging
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+DEFAULTS = {
+    'SIZE': 5,
+    'MAX_OVERFLOW': 5,
+    'MAX_AGE': 600,
+    'TIMEOUT': 10,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+
+class PoolTimeout(Exception):
+    pass
+
+
+class ConnectionPool(object):
+
+    def __init__(self, size, max_overflow, max_age, timeout,
+                 health_check_interval):
+        self.size = size
+        self.max_overflow = max_overflow
+        self.max_age = max_age
+        self.timeout = timeout
+        self.health_check_interval = health_check_interval
+        self._cond = threading.Condition()
+        # (connection, created, last used), most recently used last
+        self._idle = []
+        self._created = {}
+        self._open = 0
+        self._checked_out = 0
+        self._waits = 0
+        self._wait_time = 0.0
+        self._timeouts = 0
+
+    def _healthy(self, conn, created, last_used):
+        now = time.time()
+        if conn.closed:
+            return False
+        if self.max_age and now - created > self.max_age:
+            return False
+        if now - last_used > self.health_check_interval:
+            try:
+                cursor = conn.cursor()
+                cursor.execute('SELECT 1')
+                cursor.close()
+                conn.rollback()
+            except Exception:
+                return False
+        return True
+
+    def _discard(self, conn):
+        self._created.pop(id(conn), None)
+        try:
+            conn.close()
+        except Exception:
+            logger.debug('error closing pooled connection', exc_info=True)
+        with self._cond:
+            self._open -= 1
+            self._cond.notify()
+
+    def checkout(self, connect):
+        '''return an idle connection or one made by connect()'''
+        start = time.time()
+        deadline = start + self.timeout
+        waited = False
+        while True:
+            with self._cond:
+                while True:
+                    if self._idle:
+                        conn, created, last_used = self._idle.pop()
+                        break
+                    if self._open < self.size + self.max_overflow:
+                        self._open += 1
+                        conn = None
+                        break
+                    remaining = deadline - time.time()
+                    if remaining <= 0:
+                        self._timeouts += 1
+                        raise PoolTimeout('no connection available after %ss' % self.timeout)
+                    waited = True
+                    self._cond.wait(remaining)
+
+            if conn is None:
+                try:
+                    conn = connect()
+                except Exception:
+                    with self._cond:
+                        self._open -= 1
+                        self._cond.notify()
+                    raise
+                self._created[id(conn)] = time.time()
+            elif not self._healthy(conn, created, last_used):
+                self._discard(conn)
+                continue
+
+            with self._cond:
+                self._checked_out += 1
+                if waited:
+                    self._waits += 1
+                    self._wait_time += time.time() - start
+            return conn
+
+    def checkin(self, conn):
+        with self._cond:
+            self._checked_out -= 1
+            overflow = self._open > self.size
+        if overflow or conn.closed:
+            self._discard(conn)
+            return
+        try:
+            # never hand out a connection in the middle of a transaction
+            conn.rollback()
+        except Exception:
+            self._discard(conn)
+            return
+        created = self._created.get(id(conn), time.time())
+        with self._cond:
+            self._idle.append((conn, created, time.time()))
+            self._cond.notify()
+
+    def clear(self):
+        '''close the idle connections'''
+        with self._cond:
+            idle, self._idle = self._idle, []
+        for conn, created, last_used in idle:
+            self._discard(conn)
+
+    def stats(self):
+        with self._cond:
+            return dict(
+                size=self.size,
+                open=self._open,
+                idle=len(self._idle),
+                checked_out=self._checked_out,
+                overflow=max(0, self._open - self.size),
+                waits=self._waits,
+                wait_time=round(self._wait_time, 4),
+                timeouts=self._timeouts,
+            )
+
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def get_pool(alias, settings_dict):
+    try:
+        return _pools[alias]
+    except KeyError:
+        pass
+    with _pools_lock:
+        if alias not in _pools:
+            options = dict(DEFAULTS, **settings_dict.get('POOL', {}))
+            _pools[alias] = ConnectionPool(
+                size=options['SIZE'],
+                max_overflow=options['MAX_OVERFLOW'],
+                max_age=options['MAX_AGE'],
+                timeout=options['TIMEOUT'],
+                health_check_interval=options['HEALTH_CHECK_INTERVAL'],
+            )
+        return _pools[alias]
+
+
+def stats():
+    '''{alias: pool statistics} for every pool used by this process'''
+    return dict((alias, pool.stats()) for alias, pool in _pools.items())
+
+
+def clear():
+    '''close the idle connections of every pool'''
+    for pool in _pools.values():
+        pool.clear()
+
+
+def close_all():
+    '''close every connection of this process, pooled or not, so processes
+    forked afterwards do not share their sockets'''
+    for conn in connections.all():
+        conn.close()
+    clear()
+
+
+class PooledDatabaseWrapperMixin(object):
+    '''Takes connections from the alias' pool and gives them back on close'''
+
+    def get_new_connection(self, conn_params):
+        parent = super(PooledDatabaseWrapperMixin, self)
+        return get_pool(self.alias, self.settings_dict).checkout(
+            lambda: parent.get_new_connection(conn_params))
+
+    def _close(self):
+        if self.connection is not None:
+            get_pool(self.alias, self.settings_dict).checkin(self.connection)
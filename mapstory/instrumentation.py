@@ -0,0 +1,115 @@
+'''
+Lightweight per-request timing of the hot paths: SQL, template rendering,
+textile conversion and link rendering.
+
+Enable with INSTRUMENTATION_ENABLED. A sample of INSTRUMENTATION_SAMPLE_RATE
+requests is measured and reported in a Server-Timing header and as a JSON line
+on the mapstory.instrumentation logger. Unsampled requests only pay for a
+thread local lookup in the timed functions.
+'''
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from django.template.base import Template
+from mapstory.db import pool
+from functools import wraps
+import json
+import logging
+import random
+import threading
+import time
+
+
+logger = logging.getLogger(__name__)
+
+_local = threading.local()
+
+
+def _timings():
+    return getattr(_local, 'timings', None)
+
+
+def timed(name):
+    '''decorate a function so calls made while a request is sampled are added
+    to the time spent in name. Nested calls are only counted once.'''
+    def decorator(fun):
+        @wraps(fun)
+        def wrapper(*args, **kwargs):
+            timings = _timings()
+            if timings is None or name in _local.active:
+                return fun(*args, **kwargs)
+            _local.active.add(name)
+            start = time.time()
+            try:
+                return fun(*args, **kwargs)
+            finally:
+                _local.active.discard(name)
+                duration, count = timings.get(name, (0, 0))
+                timings[name] = duration + time.time() - start, count + 1
+        return wrapper
+    return decorator
+
+
+def _time_templates():
+    # TemplateResponse, render_to_response and render_to_string all end up in
+    # Template.render, included templates are part of their parent's time
+    render = Template.__dict__['render']
+    if not getattr(render, 'instrumented', False):
+        render = timed('template')(render)
+        render.instrumented = True
+        Template.render = render
+
+
+class InstrumentationMiddleware(object):
+
+    def __init__(self):
+        if not getattr(settings, 'INSTRUMENTATION_ENABLED', False):
+            raise MiddlewareNotUsed()
+        self.sample_rate = getattr(settings, 'INSTRUMENTATION_SAMPLE_RATE', 1)
+        _time_templates()
+
+    def process_request(self, request):
+        _local.timings = None
+        if random.random() >= self.sample_rate:
+            return
+        _local.timings = {}
+        _local.active = set()
+        _local.start = time.time()
+        _local.queries = {}
+        for conn in connections.all():
+            _local.queries[conn.alias] = (conn.use_debug_cursor,
+                                          len(conn.queries))
+            conn.use_debug_cursor = True
+
+    def process_response(self, request, response):
+        timings = _timings()
+        if timings is None:
+            return response
+        _local.timings = None
+        total = time.time() - _local.start
+        sql_time, sql_count = 0, 0
+        for conn in connections.all():
+            use_debug_cursor, offset = _local.queries.get(conn.alias, (None, 0))
+            queries = conn.queries[offset:]
+            sql_count += len(queries)
+            sql_time += sum(float(q['time']) for q in queries)
+            conn.use_debug_cursor = use_debug_cursor
+            if not settings.DEBUG:
+                # only DEBUG keeps the query log around
+                del conn.queries[offset:]
+        timings['sql'] = sql_time, sql_count
+        timings['total'] = total, 1
+
+        response['Server-Timing'] = ', '.join(
+            '%s;dur=%.1f;desc="%d calls"' % (name, duration * 1000, count)
+            for name, (duration, count) in sorted(timings.items())
+        )
+        logger.info(json.dumps(dict(
+            path=request.path,
+            method=request.method,
+            status=response.status_code,
+            timings=dict((name, dict(ms=round(duration * 1000, 2), count=count))
+                         for name, (duration, count) in timings.items()),
+            pools=pool.stats(),
+        ), sort_keys=True))
+        return response
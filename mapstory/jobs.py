@@ -0,0 +1,182 @@
+'''
+A small database backed job queue for work too slow for a request.
+
+enqueue(fun, *args) stores a call of a module level function, by its dotted
+name and JSON arguments, in the Job table. The run_worker command claims
+queued jobs and runs them in worker processes, so no broker is needed and a
+job enqueued in a transaction only becomes visible when it commits. With
+JOBS_EAGER (the default in DEBUG) jobs run immediately instead.
+
+Workers also delete finished jobs older than JOBS_KEEP_DAYS and requeue jobs
+running for longer than JOBS_TIMEOUT, which were left behind by a worker
+that died, so a job may run more than once and should be idempotent.
+
+Job is defined here and imported by mapstory.models so the models can
+enqueue jobs without importing the functions they run.
+'''
+from django.conf import settings
+from django.db import connection
+from django.db import models
+from django.utils import timezone
+from datetime import timedelta
+from importlib import import_module
+from mapstory.db import pool
+from multiprocessing import Process
+import json
+import logging
+import os
+import time
+import traceback
+
+
+logger = logging.getLogger(__name__)
+
+# primary keys per job of the bulk operations
+BATCH_SIZE = 500
+# seconds between the housekeeping of a worker
+HOUSEKEEPING_INTERVAL = 60
+
+
+class Job(models.Model):
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = QUEUED, RUNNING, DONE, FAILED
+
+    name = models.CharField(max_length=200)
+    args = models.TextField(default='[]')
+    status = models.CharField(max_length=8, default=QUEUED,
+                              choices=[(s, s) for s in STATUSES])
+    created = models.DateTimeField(auto_now_add=True)
+    started = models.DateTimeField(null=True, blank=True)
+    finished = models.DateTimeField(null=True, blank=True)
+    error = models.TextField(blank=True)
+
+    def __unicode__(self):
+        return '%s%s' % (self.name, tuple(json.loads(self.args)))
+
+    class Meta:
+        app_label = 'mapstory'
+        ordering = ['-id']
+        # workers look for the oldest queued job
+        index_together = [['status', 'id']]
+
+
+def _name(fun):
+    if isinstance(fun, basestring):
+        return fun
+    return '%s.%s' % (fun.__module__, fun.__name__)
+
+
+def _resolve(name):
+    module, fun = name.rsplit('.', 1)
+    return getattr(import_module(module), fun)
+
+
+def enqueue(fun, *args):
+    '''queue fun(*args), fun is a module level function or its dotted name and
+    args are JSON serializable'''
+    job = Job(name=_name(fun), args=json.dumps(args))
+    if getattr(settings, 'JOBS_EAGER', False):
+        _resolve(job.name)(*args)
+        return job
+    job.save()
+    return job
+
+
+def enqueue_batches(fun, pks, *args):
+    '''queue fun(pks, *args) for every BATCH_SIZE of pks, return the jobs'''
+    pks = list(pks)
+    return [enqueue(fun, pks[i:i + BATCH_SIZE], *args)
+            for i in range(0, len(pks), BATCH_SIZE)]
+
+
+def claim():
+    '''mark the oldest queued job running and return it, None if there is none'''
+    for pk in Job.objects.filter(status=Job.QUEUED).order_by('id').values_list('pk', flat=True)[:10]:
+        # another worker may have claimed it since
+        if Job.objects.filter(pk=pk, status=Job.QUEUED).update(
+                status=Job.RUNNING, started=timezone.now()):
+            return Job.objects.get(pk=pk)
+    return None
+
+
+def run(job):
+    try:
+        _resolve(job.name)(*json.loads(job.args))
+    except Exception:
+        logger.exception('job %s failed', job.pk)
+        job.status, job.error = Job.FAILED, traceback.format_exc()
+    else:
+        job.status, job.error = Job.DONE, ''
+    job.finished = timezone.now()
+    Job.objects.filter(pk=job.pk).update(
+        status=job.status, error=job.error, finished=job.finished)
+
+
+def run_pending():
+    '''run the queued jobs in this process until there are none, return how
+    many ran'''
+    ran = 0
+    job = claim()
+    while job is not None:
+        run(job)
+        ran += 1
+        job = claim()
+    return ran
+
+
+def prune(days=None):
+    '''delete the jobs that finished more than days ago, by default
+    JOBS_KEEP_DAYS, return how many'''
+    if days is None:
+        days = getattr(settings, 'JOBS_KEEP_DAYS', 7)
+    old = Job.objects.filter(status__in=(Job.DONE, Job.FAILED),
+                             finished__lt=timezone.now() - timedelta(days=days))
+    count = old.count()
+    old.delete()
+    return count
+
+
+def requeue_stale(timeout=None):
+    '''queue the jobs running for more than timeout seconds, by default
+    JOBS_TIMEOUT, again and return how many'''
+    if timeout is None:
+        timeout = getattr(settings, 'JOBS_TIMEOUT', 60 * 60)
+    stale = Job.objects.filter(status=Job.RUNNING,
+                               started__lt=timezone.now() - timedelta(seconds=timeout))
+    count = stale.update(status=Job.QUEUED, started=None)
+    if count:
+        logger.warning('requeued %d jobs running for more than %s seconds', count, timeout)
+    return count
+
+
+def housekeeping():
+    prune()
+    requeue_stale()
+
+
+def work(poll=1.0):
+    '''run jobs forever, waiting poll seconds when the queue is empty'''
+    logger.info('job worker %s started', os.getpid())
+    last_housekeeping = 0
+    while True:
+        # every worker does it, the statements are safe to run concurrently
+        if time.time() - last_housekeeping > HOUSEKEEPING_INTERVAL:
+            housekeeping()
+            last_housekeeping = time.time()
+        if not run_pending():
+            # do not hold a connection while idle
+            connection.close()
+            time.sleep(poll)
+
+
+def start_workers(n, poll=1.0):
+    '''fork n worker processes and return them'''
+    pool.close_all()
+    workers = [Process(target=work, args=(poll,)) for i in range(n)]
+    for worker in workers:
+        worker.daemon = True
+        worker.start()
+    return workers
@@ -0,0 +1,224 @@
+from contextlib import contextmanager
+from optparse import make_option
+import json
+import resource
+import shutil
+import sys
+import tempfile
+import time
+
+from django.core import cache as django_cache
+from django.core.cache import get_cache
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.signals import request_started
+from django.core.urlresolvers import reverse
+from django.db import connection
+from django.test.client import Client
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.test.utils import setup_test_environment
+from django.test.utils import teardown_test_environment
+
+from mapstory import context_processors
+from mapstory import seed
+from mapstory.models import DiaryEntry
+from mapstory.models import GetPage
+from geonode.maps.models import Map
+from geonode.people.models import Profile
+
+
+def _routes():
+    entry = DiaryEntry.objects.filter(publish=True)[0]
+    page = GetPage.objects.all()[0]
+    profile = Profile.objects.all()[0]
+    map_obj = Map.objects.all()[0]
+    return [
+        ('index', '/'),
+        ('diary', reverse('diary')),
+        ('diary-detail', reverse('diary-detail', args=[entry.pk])),
+        ('getpage', reverse('getpage', args=[page.name])),
+        ('about-leaders', reverse('about-leaders')),
+        ('profile_detail', reverse('profile_detail', args=[profile.username])),
+        ('search', reverse('search')),
+        ('storylayerpage', reverse('storylayerpage')),
+        ('mapstorypage', reverse('mapstorypage')),
+        ('editor_tour', reverse('editor_tour')),
+        ('map-view2', reverse('map-view2', args=[map_obj.pk])),
+        ('map-new2', reverse('map-new2')),
+        # the seeded layers are not in GeoServer, this measures the fan out
+        ('map-frames', reverse('map-frames', args=[map_obj.pk]) +
+         '?start=2000&end=2001&frames=2&bbox=0,0,1,1'),
+        ('search-content', reverse('search-content') + '?q=map'),
+        ('search-facets', reverse('search-facets')),
+    ]
+
+
+@contextmanager
+def _private_cache():
+    '''run with a cache of this process instead of the shared one, so the
+    run neither finds entries of the site nor leaves its own behind'''
+    private = get_cache('django.core.cache.backends.locmem.LocMemCache',
+                        LOCATION='benchmark_routes')
+    shared = django_cache.cache
+    # modules keep the default cache they imported
+    users = [m for m in sys.modules.values()
+             if m is not None and getattr(m, 'cache', None) is shared]
+    for module in users:
+        module.cache = private
+    try:
+        with override_settings(CACHES={'default': {
+                'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+                'LOCATION': 'benchmark_routes'}}):
+            yield
+    finally:
+        for module in users:
+            module.cache = shared
+
+
+def _reset_template_globals(sender, **kwargs):
+    context_processors.reset()
+
+
+# growth of the resident set size allowed on top of the tolerance, small
+# deltas are mostly allocator noise
+RSS_SLACK_KB = 1024
+
+
+def _rss_kb():
+    '''the current resident set size of this process, None without /proc'''
+    try:
+        with open('/proc/self/statm') as fp:
+            return int(fp.read().split()[1]) * resource.getpagesize() // 1024
+    except IOError:
+        return None
+
+
+def _get(client, url):
+    try:
+        return client.get(url).status_code
+    except Exception:
+        # the test client raises what the view raised, report it as the
+        # server would
+        return 500
+
+
+def measure(client, url, repeat):
+    '''request url repeat times and report the fastest run'''
+    runs = []
+    rss = _rss_kb()
+    for i in range(repeat):
+        with CaptureQueriesContext(connection) as queries:
+            start = time.time()
+            status = _get(client, url)
+            total = (time.time() - start) * 1000
+        sql = sum(float(q['time']) for q in queries.captured_queries) * 1000
+        runs.append(dict(
+            status=status,
+            queries=len(queries),
+            sql_ms=round(sql, 2),
+            # total minus SQL: the view, templates, middleware and client
+            non_sql_ms=round(total - sql, 2),
+            total_ms=round(total, 2),
+        ))
+    result = min(runs, key=lambda r: r['total_ms'])
+    # later runs may be served from caches, keep the cold count as well
+    result['cold_queries'] = runs[0]['queries']
+    result['url'] = url
+    # the memory the route kept, the peak would be that of all routes so far
+    if rss is not None:
+        result['rss_delta_kb'] = _rss_kb() - rss
+    return result
+
+
+def compare(results, baseline, tolerance):
+    '''list the regressions of results against baseline'''
+    regressions = []
+    for name, base in baseline['routes'].items():
+        current = results['routes'].get(name)
+        if current is None:
+            regressions.append('%s: route missing' % name)
+            continue
+        # baselines written by older versions lack some of the keys
+        if 'status' in base and current['status'] != base['status']:
+            regressions.append('%s: status %s, was %s' % (
+                name, current['status'], base['status']))
+        for key in ('queries', 'cold_queries'):
+            if key in base and current[key] > base[key]:
+                regressions.append('%s: %s %d, was %d' % (
+                    name, key, current[key], base[key]))
+        if 'total_ms' in base and current['total_ms'] > base['total_ms'] * (1 + tolerance):
+            regressions.append('%s: total_ms %s, was %s' % (
+                name, current['total_ms'], base['total_ms']))
+        if 'rss_delta_kb' in current and 'rss_delta_kb' in base:
+            allowed = max(base['rss_delta_kb'], 0) * (1 + tolerance) + RSS_SLACK_KB
+            if current['rss_delta_kb'] > allowed:
+                regressions.append('%s: rss_delta_kb %s, was %s' % (
+                    name, current['rss_delta_kb'], base['rss_delta_kb']))
+    return regressions
+
+
+class Command(BaseCommand):
+    help = ('Seed a throwaway database, request every mapstory route and '
+            'report query counts, timings and memory as JSON')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--users', type='int', default=25),
+        make_option('--entries', type='int', default=100),
+        make_option('--sponsors', type='int', default=10),
+        make_option('--news', type='int', default=10),
+        make_option('--contents', type='int', default=10),
+        make_option('--maps', type='int', default=5),
+        make_option('--repeat', type='int', default=5,
+                    help='Requests per route, the fastest is reported'),
+        make_option('--output', default='benchmark.json',
+                    help='File to write the results to'),
+        make_option('--baseline',
+                    help='Results to compare against, regressions fail'),
+        make_option('--tolerance', type='float', default=.5,
+                    help='Allowed relative growth of time and memory'),
+    )
+
+    def handle(self, *args, **options):
+        setup_test_environment()
+        old_name = connection.creation.create_test_db(verbosity=0)
+        media_root = tempfile.mkdtemp()
+        try:
+            with override_settings(MEDIA_ROOT=media_root), _private_cache():
+                results = self.benchmark(options)
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            teardown_test_environment()
+            shutil.rmtree(media_root)
+
+        with open(options['output'], 'w') as fp:
+            json.dump(results, fp, indent=2, sort_keys=True)
+        for name, r in sorted(results['routes'].items()):
+            self.stdout.write(
+                '%-16s %3s %4d queries %8.2f ms sql %8.2f ms non-sql %8.2f ms total' % (
+                    name, r['status'], r['queries'], r['sql_ms'], r['non_sql_ms'],
+                    r['total_ms']))
+
+        if options['baseline']:
+            with open(options['baseline']) as fp:
+                baseline = json.load(fp)
+            regressions = compare(results, baseline, options['tolerance'])
+            if regressions:
+                raise CommandError('regressions:\n' + '\n'.join(regressions))
+
+    def benchmark(self, options):
+        sizes = dict((key, options[key]) for key in
+                     ('users', 'entries', 'news', 'sponsors', 'contents', 'maps'))
+        seed.seed(**sizes)
+        client = Client()
+        routes = {}
+        for name, url in _routes():
+            routes[name] = measure(client, url, options['repeat'])
+        # the index recomputing the template globals on every request, as it
+        # did before they were precomputed
+        request_started.connect(_reset_template_globals)
+        try:
+            routes['index-no-globals'] = measure(client, '/', options['repeat'])
+        finally:
+            request_started.disconnect(_reset_template_globals)
+        return dict(seed=sizes, routes=routes)
@@ -0,0 +1,37 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mapstory.seed import BULK_MODELS
+from mapstory.seed import bulk_seed
+
+
+class Command(BaseCommand):
+    help = ('Load large volumes of synthetic content for load tests, '
+            'run rebuild_search_index afterwards')
+
+    option_list = BaseCommand.option_list + tuple(
+        make_option('--%s' % name, type='int', default=0,
+                    help='Number of %s to insert' % model._meta.verbose_name_plural)
+        for name, model, build in BULK_MODELS
+    ) + (
+        make_option('--batch-size', type='int', default=1000,
+                    help='Rows inserted per query and transaction'),
+        make_option('--workers', type='int', default=1,
+                    help='Worker processes inserting batches, needs PostgreSQL'),
+        make_option('--seed', type='int', default=0,
+                    help='Seed of the generated data'),
+        make_option('--no-render', action='store_false', dest='render', default=True,
+                    help='Leave the textile to be rendered on the first view'),
+    )
+
+    def handle(self, *args, **options):
+        counts = dict((name, options[name]) for name, model, build in BULK_MODELS)
+        step = max(options['batch_size'], max(counts.values()) // 20)
+
+        def progress(name, inserted):
+            if inserted % step < options['batch_size'] or inserted == counts[name]:
+                self.stdout.write('%s: inserted %d of %d' % (name, inserted, counts[name]))
+
+        bulk_seed(counts, options['batch_size'], options['workers'], options['seed'],
+                  options['render'], progress)
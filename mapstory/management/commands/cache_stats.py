@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from mapstory import cache
+
+
+class Command(BaseCommand):
+    help = 'Report hit and miss counts of the mapstory caches'
+
+    def handle(self, *args, **options):
+        for name, counts in sorted(cache.stats().items()):
+            total = counts['hit'] + counts['miss']
+            ratio = float(counts['hit']) / total if total else 0
+            self.stdout.write('%-30s hits %8d  misses %8d  ratio %.2f' % (
+                name, counts['hit'], counts['miss'], ratio))
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+from mapstory.template_cache import compile_templates
+from mapstory.template_cache import template_names
+
+
+class Command(BaseCommand):
+    help = 'Compile every mapstory template and fail if any does not compile'
+
+    def handle(self, *args, **options):
+        names = template_names()
+        errors = compile_templates(names)
+        for name, error in sorted(errors.items()):
+            self.stderr.write('%s: %s' % (name, error))
+        if errors:
+            raise CommandError('%d of %d templates do not compile' % (len(errors), len(names)))
+        self.stdout.write('%d templates compiled' % len(names))
@@ -0,0 +1,41 @@
+import cPickle as pickle
+import importlib
+import os
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+
+
+class Command(BaseCommand):
+    args = '[path]'
+    help = ('Assemble the settings and dump them to a file that workers load '
+            'directly when MAPSTORY_SETTINGS_CACHE points at it')
+
+    def handle(self, path=None, **options):
+        path = path or os.environ.get('MAPSTORY_SETTINGS_CACHE')
+        if not path:
+            raise CommandError('no path given and MAPSTORY_SETTINGS_CACHE unset')
+
+        # always assemble from scratch, never from a previous dump
+        module = importlib.import_module('mapstory.settings.base')
+        values = dict((name, value) for name, value in vars(module).items()
+                      if name.isupper())
+
+        unpicklable = []
+        for name, value in values.items():
+            try:
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                unpicklable.append(name)
+        if unpicklable:
+            raise CommandError('cannot dump settings: %s' % ', '.join(sorted(unpicklable)))
+
+        # only readable by its owner, mapstory.settings refuses anything else
+        tmp = path + '.tmp'
+        if os.path.lexists(tmp):
+            os.unlink(tmp)
+        fd = os.open(tmp, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0600)
+        with os.fdopen(fd, 'wb') as fp:
+            pickle.dump(values, fp, pickle.HIGHEST_PROTOCOL)
+        os.rename(tmp, path)
+        self.stdout.write('dumped %d settings to %s' % (len(values), path))
@@ -0,0 +1,40 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from avatar.models import Avatar
+from avatar.settings import AUTO_GENERATE_AVATAR_SIZES
+from django.core.management.base import BaseCommand
+
+from mapstory.models import Sponsor
+
+
+def _sponsor_thumbnails(sponsor):
+    return len(sponsor.make_thumbnails())
+
+
+def _avatar_thumbnails(avatar):
+    for size in AUTO_GENERATE_AVATAR_SIZES:
+        avatar.create_thumbnail(size)
+    return len(AUTO_GENERATE_AVATAR_SIZES)
+
+
+class Command(BaseCommand):
+    help = 'Make the resized variants of every sponsor icon and avatar'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help='Number of threads resizing images'),
+    )
+
+    def handle(self, *args, **options):
+        pool = ThreadPool(options['workers'])
+        try:
+            for fun, objects in (
+                    (_sponsor_thumbnails, list(Sponsor.objects.exclude(icon=''))),
+                    (_avatar_thumbnails, list(Avatar.objects.all()))):
+                made = sum(pool.imap_unordered(fun, objects))
+                self.stdout.write('%s: made %d variants of %d images' % (
+                    fun.__name__.strip('_').split('_')[0], made, len(objects)))
+        finally:
+            pool.close()
+            pool.join()
@@ -0,0 +1,33 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from mapstory.models import SEARCHABLE_MODELS
+from mapstory.models import SearchDocument
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full text search index of all editorial content'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--batch-size', type='int', default=500,
+                    help='Documents inserted per query'),
+    )
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        with transaction.atomic():
+            SearchDocument.objects.all().delete()
+            for model in SEARCHABLE_MODELS:
+                batch = []
+                indexed = 0
+                for obj in model.objects.all().iterator():
+                    batch.append(SearchDocument.for_object(obj))
+                    if len(batch) == batch_size:
+                        SearchDocument.objects.bulk_create(batch)
+                        indexed += len(batch)
+                        batch = []
+                SearchDocument.objects.bulk_create(batch)
+                indexed += len(batch)
+                self.stdout.write('%s: indexed %d' % (model.__name__, indexed))
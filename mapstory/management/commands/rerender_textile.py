@@ -0,0 +1,30 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mapstory.models import DiaryEntry
+from mapstory.models import GetPageContent
+from mapstory.models import Leader
+from mapstory.models import NewsItem
+
+
+class Command(BaseCommand):
+    help = 'Re-render the cached textile HTML of all content'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--stale', action='store_true', default=False,
+                    help='Only re-render entries whose cache is out of date'),
+    )
+
+    def handle(self, *args, **options):
+        stale_only = options['stale']
+        for model in (NewsItem, DiaryEntry, GetPageContent, Leader):
+            rendered = 0
+            for obj in model.objects.all().iterator():
+                if stale_only and not obj.is_stale():
+                    continue
+                obj.render_html()
+                model.objects.filter(pk=obj.pk).update(
+                    html_cache=obj.html_cache, html_stamp=obj.html_stamp)
+                rendered += 1
+            self.stdout.write('%s: re-rendered %d' % (model.__name__, rendered))
@@ -0,0 +1,32 @@
+from multiprocessing.pool import ThreadPool
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+
+from mapstory.models import Sponsor
+from mapstory.models import _stamp_file
+
+
+def _restamp(sponsor):
+    return sponsor.pk, _stamp_file(sponsor.icon)
+
+
+class Command(BaseCommand):
+    help = 'Recompute the icon stamp of every sponsor'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=4,
+                    help='Number of threads hashing icons'),
+    )
+
+    def handle(self, *args, **options):
+        sponsors = list(Sponsor.objects.exclude(icon=''))
+        pool = ThreadPool(options['workers'])
+        try:
+            # hashing happens in the pool, the database is only touched here
+            for pk, stamp in pool.imap_unordered(_restamp, sponsors):
+                Sponsor.objects.filter(pk=pk).update(stamp=stamp)
+        finally:
+            pool.close()
+            pool.join()
+        self.stdout.write('restamped %d sponsors' % len(sponsors))
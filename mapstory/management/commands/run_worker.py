@@ -0,0 +1,37 @@
+from optparse import make_option
+import time
+
+from django.core.management.base import BaseCommand
+
+from mapstory import jobs
+
+
+class Command(BaseCommand):
+    help = 'Run the queued background jobs'
+
+    option_list = BaseCommand.option_list + (
+        make_option('--workers', type='int', default=2,
+                    help='Number of worker processes'),
+        make_option('--poll', type='float', default=1.0,
+                    help='Seconds to wait when the queue is empty'),
+        make_option('--once', action='store_true', default=False,
+                    help='Run the queued jobs in this process and exit'),
+    )
+
+    def handle(self, *args, **options):
+        if options['once']:
+            self.stdout.write('ran %d jobs' % jobs.run_pending())
+            return
+        workers = jobs.start_workers(options['workers'], options['poll'])
+        try:
+            # restart the workers that died, a job may have crashed one
+            while True:
+                for i, worker in enumerate(workers):
+                    if not worker.is_alive():
+                        self.stderr.write('worker %s exited with %s, restarting' % (
+                            worker.pid, worker.exitcode))
+                        workers[i] = jobs.start_workers(1, options['poll'])[0]
+                time.sleep(options['poll'])
+        except KeyboardInterrupt:
+            for worker in workers:
+                worker.terminate()
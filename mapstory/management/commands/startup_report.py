@@ -0,0 +1,68 @@
+from optparse import make_option
+import json
+import os
+import subprocess
+import sys
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+
+
+# runs in a fresh interpreter so nothing is imported yet
+_PROBE = '''
+import json, os, time
+start = time.time()
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'mapstory.settings')
+from django.conf import settings
+settings.INSTALLED_APPS
+settings_done = time.time()
+from django.db.models.loading import get_models
+get_models()
+models_done = time.time()
+from django.core.urlresolvers import get_resolver
+get_resolver(None).url_patterns
+urls_done = time.time()
+from django.core.wsgi import get_wsgi_application
+get_wsgi_application()
+wsgi_done = time.time()
+print(json.dumps(dict(
+    settings=settings_done - start,
+    models=models_done - settings_done,
+    urls=urls_done - models_done,
+    wsgi=wsgi_done - urls_done,
+    total=wsgi_done - start,
+)))
+'''
+
+_STEPS = 'settings', 'models', 'urls', 'wsgi', 'total'
+
+
+def probe(env):
+    output = subprocess.check_output([sys.executable, '-c', _PROBE], env=env,
+                                     cwd=os.path.dirname(settings.LOCAL_ROOT))
+    return json.loads(output.strip().splitlines()[-1])
+
+
+class Command(BaseCommand):
+    help = ('Report how long a fresh process takes to import the settings, '
+            'load the models and urls and create the WSGI application')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--repeat', type='int', default=3,
+                    help='Processes started per variant, the fastest is reported'),
+    )
+
+    def handle(self, *args, **options):
+        env = dict(os.environ)
+        env.pop('MAPSTORY_SETTINGS_CACHE', None)
+        variants = [('assembled', env)]
+        cache = os.environ.get('MAPSTORY_SETTINGS_CACHE')
+        if cache and os.path.exists(cache):
+            variants.append(('cached', dict(env, MAPSTORY_SETTINGS_CACHE=cache)))
+
+        self.stdout.write('%-10s' % '' + ''.join('%10s' % s for s in _STEPS))
+        for name, variant_env in variants:
+            runs = [probe(variant_env) for i in range(options['repeat'])]
+            best = min(runs, key=lambda r: r['total'])
+            self.stdout.write('%-10s' % name + ''.join(
+                '%8.0fms' % (best[s] * 1000) for s in _STEPS))
@@ -0,0 +1,82 @@
+from optparse import make_option
+
+from django.core.management.base import BaseCommand
+from django.core.management.base import CommandError
+from django.core.management.color import no_style
+from django.db import connection
+from django.db import transaction
+from django.db.models import DateTimeField
+from django.db.models import get_app
+from django.db.models import get_models
+from django.utils import timezone
+import re
+
+
+_INDEXES_SQL = {
+    'postgresql': 'SELECT indexname FROM pg_indexes WHERE tablename = %s',
+    'sqlite': "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = %s",
+}
+_INDEX_NAME_RE = re.compile(r'CREATE INDEX "?(\w+)"?')
+
+
+def _initial_value(field):
+    '''the value existing rows get for a new column'''
+    if isinstance(field, DateTimeField) and (field.auto_now or field.auto_now_add):
+        return timezone.now()
+    if field.has_default():
+        return field.get_default()
+    return field.get_db_prep_save('' if field.empty_strings_allowed else None,
+                                  connection=connection)
+
+
+def upgrade_statements(cursor, model):
+    '''[(sql, params)] adding the columns and indexes of model that its
+    existing table lacks'''
+    qn = connection.ops.quote_name
+    table = model._meta.db_table
+    columns = set(c[0] for c in connection.introspection.get_table_description(cursor, table))
+    statements = []
+    for field in model._meta.local_fields:
+        if field.column in columns or field.db_type(connection) is None:
+            continue
+        statements.append(('ALTER TABLE %s ADD COLUMN %s %s' % (
+            qn(table), qn(field.column), field.db_type(connection)), ()))
+        statements.append(('UPDATE %s SET %s = %%s' % (qn(table), qn(field.column)),
+                           (_initial_value(field),)))
+        # SQLite cannot add the constraint to an existing column
+        if not field.null and connection.vendor == 'postgresql':
+            statements.append(('ALTER TABLE %s ALTER COLUMN %s SET NOT NULL' % (
+                qn(table), qn(field.column)), ()))
+    cursor.execute(_INDEXES_SQL[connection.vendor], [table])
+    indexes = set(row[0] for row in cursor.fetchall())
+    for sql in connection.creation.sql_indexes_for_model(model, no_style()):
+        if _INDEX_NAME_RE.match(sql).group(1) not in indexes:
+            statements.append((sql, ()))
+    return statements
+
+
+class Command(BaseCommand):
+    help = ('Add the columns and indexes that mapstory models gained to tables '
+            'syncdb created before, run after syncdb')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--sql', action='store_true', default=False,
+                    help='Print the statements instead of running them'),
+    )
+
+    def handle(self, *args, **options):
+        if connection.vendor not in _INDEXES_SQL:
+            raise CommandError('%s databases are not supported' % connection.vendor)
+        with transaction.atomic():
+            cursor = connection.cursor()
+            tables = set(connection.introspection.table_names(cursor))
+            statements = []
+            for model in get_models(get_app('mapstory')):
+                if model._meta.db_table in tables and model._meta.managed:
+                    statements.extend(upgrade_statements(cursor, model))
+            for sql, params in statements:
+                self.stdout.write(sql if not params else '%s -- %r' % (sql, params))
+                if not options['sql']:
+                    cursor.execute(sql, params)
+        if not statements:
+            self.stdout.write('schema is up to date')
@@ -0,0 +1,57 @@
+'''
+Cached, serialized map configurations for the map-view2 and map-new2 pages.
+
+GeoNode builds the configuration of a map from its layers, their sources,
+MAP_BASELAYERS and the registered services on every request. The only part
+that depends on the viewer is which layers they may not see, so the
+serialized configuration is cached per map and per set of denied layers, and
+invalidated when the map or its layers change (see mapstory.models).
+
+The set of denied layers is cached per user in the map's group as well.
+Permission changes do not save the layers, they show once it expires.
+'''
+from geonode.layers.models import Layer
+from geonode.utils import default_map_config
+from guardian.shortcuts import get_objects_for_user
+from mapstory import cache
+import hashlib
+import json
+
+
+def map_group(map_id):
+    return 'map:%s' % map_id
+
+
+def _permission_class(user, map_obj):
+    names = set(n for n in map_obj.layer_set.values_list('name', flat=True) if n)
+    if not names:
+        return 'all'
+    # layers share their primary keys with their ResourceBase
+    viewable = get_objects_for_user(user, 'base.view_resourcebase').values('pk')
+    denied = Layer.objects.filter(typename__in=names).exclude(pk__in=viewable)
+    denied = list(denied.values_list('typename', flat=True))
+    if not denied:
+        return 'all'
+    return hashlib.sha1(','.join(sorted(denied))).hexdigest()[:16]
+
+
+def permission_class(user, map_obj):
+    '''the layers of the map the user may not view, as a short string'''
+    return cache.get_or_build(
+        'mapconfig:permissions:%s' % user.pk, lambda: _permission_class(user, map_obj),
+        group=map_group(map_obj.id))
+
+
+def viewer_config(user, map_obj):
+    '''the serialized viewer configuration of map_obj for user'''
+    return cache.get_or_build(
+        'mapconfig:%s' % permission_class(user, map_obj),
+        lambda: json.dumps(map_obj.viewer_json(user)),
+        group=map_group(map_obj.id))
+
+
+def default_config():
+    '''the serialized configuration of a new map, which only depends on
+    MAP_BASELAYERS and the registered services'''
+    return cache.get_or_build(
+        'mapconfig:new', lambda: json.dumps(default_map_config()[0]))
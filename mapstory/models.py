@@ -1,33 +1,122 @@
 from django.conf import settings
+from django.contrib.contenttypes.models import ContentType
 from django.core.urlresolvers import reverse
 from django.db import models
+from django.db.models import signals
+from django.utils.html import strip_tags
 from datetime import datetime
+from HTMLParser import HTMLParser
+from avatar.models import Avatar
+from avatar.models import create_default_thumbnails
+from geonode.base.models import Region
+from geonode.base.models import TopicCategory
+from geonode.layers.models import Layer
 from geonode.maps.models import Map
+from geonode.maps.models import MapLayer
+from geonode.people.models import Profile
+from geonode.services.models import Service
+from mapstory import cache
+from mapstory import jobs
+from mapstory import mapconfig
+from mapstory.instrumentation import timed
+# defined with the queue, imported to be part of the app's models
+from mapstory.jobs import Job
+from mapstory import thumbnails
+from mapstory import tilecache
 import hashlib
+import logging
+import os
 import textile
 
 
+logger = logging.getLogger(__name__)
+
+
 def _stamp(data):
+    return _stamp_chunks([data])
+
+
+def _stamp_chunks(chunks):
     s = hashlib.sha1()
-    s.update(data)
+    for chunk in chunks:
+        s.update(chunk)
     return s.hexdigest()[0:8]
 
 
+def _stamp_file(f):
+    '''stamp a (Field)File by streaming it from storage in fixed-size chunks'''
+    committed = getattr(f, '_committed', True)
+    try:
+        return _stamp_chunks(f.chunks())
+    finally:
+        # uncommitted uploads still have to be written by the storage
+        if committed:
+            f.close()
+
+
+def _textile_stamp(content):
+    # the textile version is part of the stamp so an upgrade invalidates
+    # every cached rendering
+    return _stamp(textile.__version__ + content.encode('utf-8'))
+
+
+def _sponsor_icon_path(instance, filename):
+    # uploads are restamped before they are saved, naming them by their
+    # content lets the icons be cached forever
+    root, ext = os.path.splitext(filename)
+    if instance.stamp:
+        root = '%s.%s' % (root, instance.stamp)
+    return 'sponsors/%s%s' % (root, ext)
+
+
 class Sponsor(models.Model):
     name = models.CharField(max_length=64)
     link = models.URLField(blank=False)
-    icon = models.ImageField(blank=False, upload_to='sponsors')
+    icon = models.ImageField(blank=False, upload_to=_sponsor_icon_path)
     description = models.TextField(blank=True)
     order = models.IntegerField(blank=True, default=0)
     stamp = models.CharField(max_length=8, blank=True)
+    modified = models.DateTimeField(auto_now=True)
+
+    def __init__(self, *args, **kwargs):
+        super(Sponsor, self).__init__(*args, **kwargs)
+        self._loaded_icon_name = self.icon.name
 
     def url(self):
+        if self.stamp and self.stamp in os.path.basename(self.icon.name):
+            return self.icon.url
+        # icons stored before their names carried the stamp
         return self.icon.url + "?" + self.stamp
 
+    def icon_changed(self):
+        '''True if the icon was replaced since this instance was loaded'''
+        if not getattr(self.icon, '_committed', True):
+            return True
+        return self.icon.name != self._loaded_icon_name
+
+    def restamp(self):
+        self.stamp = _stamp_file(self.icon) if self.icon.name else ''
+
     def save(self, *args, **kwargs):
-        if self.icon.name:
-            self.stamp = _stamp(self.icon.read())
+        icon_changed = self.icon_changed()
+        if icon_changed or (self.icon.name and not self.stamp):
+            self.restamp()
         super(Sponsor, self).save(*args, **kwargs)
+        self._loaded_icon_name = self.icon.name
+        if icon_changed and self.icon.name:
+            jobs.enqueue('mapstory.tasks.make_sponsor_thumbnails', [self.pk])
+
+    def make_thumbnails(self):
+        return thumbnails.make_variants(
+            self.icon.storage, self.icon.name, settings.SPONSOR_ICON_SIZES)
+
+    def srcset(self):
+        return thumbnails.srcset(self.icon.storage, self.icon.name, settings.SPONSOR_ICON_SIZES,
+                                 thumbnails.fallback_format(self.icon.name)[1])
+
+    def webp_srcset(self):
+        return thumbnails.srcset(self.icon.storage, self.icon.name,
+                                 settings.SPONSOR_ICON_SIZES, '.webp')
 
     def __unicode__(self):
         return 'Sponser - %s' % self.name
@@ -41,7 +130,41 @@ class Sponsor(models.Model):
     image_tag.allow_tags = True
 
 
-class ContentMixin(models.Model):
+class TextileMixin(models.Model):
+    '''Keeps the textile rendering of `content` next to it, keyed by a stamp
+    of the source. Stale or missing renderings are rebuilt on save or on the
+    first call to html().'''
+    html_cache = models.TextField(blank=True, editable=False)
+    html_stamp = models.CharField(max_length=8, blank=True, editable=False)
+    # validates conditional requests of the pages showing the content
+    modified = models.DateTimeField(auto_now=True)
+
+    def is_stale(self):
+        return self.html_stamp != _textile_stamp(self.content)
+
+    def render_html(self):
+        self.html_cache = textile.textile(self.content)
+        self.html_stamp = _textile_stamp(self.content)
+
+    @timed('textile')
+    def html(self):
+        if self.is_stale():
+            self.render_html()
+            if self.pk:
+                type(self).objects.filter(pk=self.pk).update(
+                    html_cache=self.html_cache, html_stamp=self.html_stamp)
+        return self.html_cache
+
+    def save(self, *args, **kwargs):
+        if self.is_stale():
+            self.render_html()
+        super(TextileMixin, self).save(*args, **kwargs)
+
+    class Meta:
+        abstract = True
+
+
+class ContentMixin(TextileMixin):
     content = models.TextField(
         help_text="use <a href=%s target='_'>textile</a> for the content" %
         'http://redcloth.org/hobix.com/textile/'
@@ -49,8 +172,11 @@ class ContentMixin(models.Model):
     date = models.DateTimeField(default=datetime.now)
     publish = models.BooleanField(default=False)
 
-    def html(self):
-        return textile.textile(self.content)
+    def is_public(self):
+        return self.publish
+
+    def get_absolute_url(self):
+        return ''
 
     class Meta:
         abstract = True
@@ -64,6 +190,10 @@ class NewsItem(ContentMixin ):
     def publication_time(self):
         return self.date
 
+    def is_public(self):
+        # news items are shown once their date has passed
+        return True
+
 
 class DiaryEntry(ContentMixin):
     title = models.CharField(max_length=32)
@@ -72,12 +202,18 @@ class DiaryEntry(ContentMixin):
     def get_absolute_url(self):
         return reverse('diary-detail', args=[self.pk])
 
+    class Meta(ContentMixin.Meta):
+        ordering = ['-date', '-id']
+        # supports the keyset pagination of the published diary
+        index_together = [['publish', 'date', 'id']]
+
 
 class GetPage(models.Model):
     name = models.SlugField(max_length=32, unique=True,
                             help_text='Do NOT include the "get" prefix')
     title = models.CharField(max_length=32)
     subtitle = models.CharField(max_length=32, blank=True)
+    modified = models.DateTimeField(auto_now=True)
 
     def published_entries(self):
         return self.contents.filter(publish=True)
@@ -95,17 +231,236 @@ class GetPageContent(ContentMixin):
     page = models.ForeignKey(GetPage, related_name='contents')
     order = models.IntegerField(blank=True, default=0)
 
+    def get_absolute_url(self):
+        return reverse('getpage', args=[self.page.name])
+
     class Meta:
         ordering = ['order']
 
 
-class Leader(models.Model):
+class Leader(TextileMixin):
     user = models.ForeignKey(settings.AUTH_USER_MODEL)
     content = models.TextField()
 
-    def html(self):
-        return textile.textile(self.content)
+
+class SearchDocument(models.Model):
+    '''The plain text of a piece of editorial content, kept up to date by
+    signals for the full text search in mapstory.search'''
+    content_type = models.ForeignKey(ContentType)
+    object_id = models.PositiveIntegerField()
+    title = models.CharField(max_length=64)
+    text = models.TextField()
+    url = models.CharField(max_length=200, blank=True)
+    date = models.DateTimeField()
+    publish = models.BooleanField(default=False)
+
+    @classmethod
+    def for_object(cls, obj):
+        '''an unsaved document of obj'''
+        return cls(
+            content_type=ContentType.objects.get_for_model(obj),
+            object_id=obj.pk,
+            title=obj.title,
+            text=plain_text(obj.html()),
+            url=obj.get_absolute_url(),
+            date=obj.date,
+            publish=obj.is_public(),
+        )
+
+    @classmethod
+    def index(cls, obj):
+        doc = cls.for_object(obj)
+        fields = dict((name, getattr(doc, name))
+                      for name in ('title', 'text', 'url', 'date', 'publish'))
+        existing = cls.objects.filter(content_type=doc.content_type, object_id=obj.pk)
+        if not existing.update(**fields):
+            doc.save()
+
+    @classmethod
+    def unindex(cls, obj):
+        cls.objects.filter(content_type=ContentType.objects.get_for_model(obj),
+                           object_id=obj.pk).delete()
+
+    class Meta:
+        unique_together = [['content_type', 'object_id']]
+
+
+SEARCHABLE_MODELS = (DiaryEntry, NewsItem, GetPageContent)
+
+
+def _label(model):
+    return '%s.%s' % (model._meta.app_label, model._meta.model_name)
+
+
+def plain_text(html):
+    return HTMLParser().unescape(strip_tags(html))
 
 
 def get_sponsors():
     return Sponsor.objects.filter(order__gte=0)
+
+
+def _invalidate_index_sponsors(sender, **kwargs):
+    cache.invalidate('index:sponsors')
+
+
+def _invalidate_index_news(sender, **kwargs):
+    cache.invalidate('index:news')
+
+
+def invalidate_content(model):
+    '''drop the cached pages showing rows of model, for changes saved
+    without signals'''
+    invalidate = {
+        NewsItem: _invalidate_index_news,
+        DiaryEntry: _invalidate_diary,
+        GetPageContent: _invalidate_getpages,
+        Leader: _invalidate_leaders,
+    }[model]
+    invalidate(model)
+
+
+def _remember_getpage_name(sender, instance, **kwargs):
+    # the name the page was cached under before a rename, dropped once the
+    # new one is saved
+    instance._previous_name = None
+    if instance.pk is not None:
+        instance._previous_name = GetPage.objects.filter(
+            pk=instance.pk).values_list('name', flat=True).first()
+
+
+def _invalidate_getpages(sender, **kwargs):
+    # pages can be renamed and contents moved between them, there are only a
+    # handful so drop them all
+    names = set(GetPage.objects.values_list('name', flat=True))
+    if sender is GetPage:
+        # deleted or renamed pages are not in the table any more
+        instance = kwargs['instance']
+        names.update(n for n in (instance.name, getattr(instance, '_previous_name', None)) if n)
+    cache.invalidate('getpages:choices', *['getpage:%s' % name for name in names])
+    cache.invalidate_group('getpages')
+
+
+def _invalidate_diary(sender, **kwargs):
+    cache.invalidate_group('diary')
+
+
+def _invalidate_leaders(sender, **kwargs):
+    cache.invalidate_group('leaders')
+
+
+def _invalidate_authors(sender, update_fields=None, **kwargs):
+    # the diary and the leaders show the names and avatars of their users,
+    # logging in only saves last_login
+    if update_fields is None or set(update_fields) - set(['last_login']):
+        cache.invalidate_group('diary', 'leaders')
+
+
+def _invalidate_layer_tiles(sender, instance, **kwargs):
+    # GetMap requests may name the layer with or without its workspace
+    for name in set(n for n in (instance.typename, instance.name) if n):
+        try:
+            tilecache.invalidate_layer(name)
+        except (IOError, OSError):
+            # a broken cache must not stop layers from being saved
+            logger.exception('could not invalidate the cached tiles of %s', name)
+
+
+def _invalidate_map_config(sender, instance, **kwargs):
+    cache.invalidate_group(mapconfig.map_group(instance.id))
+
+
+def _invalidate_map_layer_config(sender, instance, **kwargs):
+    cache.invalidate_group(mapconfig.map_group(instance.map_id))
+
+
+def _invalidate_layer_map_configs(sender, instance, **kwargs):
+    # the attribute configuration of the layer is part of every map using it
+    map_ids = set(MapLayer.objects.filter(name=instance.typename)
+                  .values_list('map_id', flat=True))
+    if map_ids:
+        cache.invalidate_group(*[mapconfig.map_group(i) for i in map_ids])
+
+
+def _invalidate_new_map_config(sender, **kwargs):
+    # existing maps pick up service changes when their entries expire
+    cache.invalidate('mapconfig:new')
+
+
+def _invalidate_search(sender, **kwargs):
+    cache.invalidate_group('search')
+
+
+def profile_group(profile_id):
+    '''cache group of the summary in mapstory.profiles'''
+    return 'profile:%s' % profile_id
+
+
+# the models counted in the profile summaries and the field naming the profile
+_PROFILE_FIELDS = {Map: 'owner_id', Layer: 'owner_id', DiaryEntry: 'author_id',
+                   Leader: 'user_id'}
+
+
+def _invalidate_profile(sender, instance, **kwargs):
+    profile_id = getattr(instance, _PROFILE_FIELDS[sender])
+    if profile_id is not None:
+        cache.invalidate_group(profile_group(profile_id))
+
+
+def _invalidate_previous_profile(sender, instance, **kwargs):
+    # the content changing hands leaves the previous profile's summary stale
+    field = _PROFILE_FIELDS[sender]
+    if instance.pk is None:
+        return
+    previous = sender.objects.filter(pk=instance.pk).values_list(field, flat=True)
+    for profile_id in previous:
+        if profile_id is not None and profile_id != getattr(instance, field):
+            cache.invalidate_group(profile_group(profile_id))
+
+
+def _index_content(sender, instance, **kwargs):
+    # bulk edits in the admin save many rows, index them in the background
+    jobs.enqueue('mapstory.tasks.index_content', _label(sender), [instance.pk])
+
+
+def _unindex_content(sender, instance, **kwargs):
+    SearchDocument.unindex(instance)
+
+
+def _avatar_thumbnails(sender, instance, created=False, **kwargs):
+    if created:
+        jobs.enqueue('mapstory.tasks.make_avatar_thumbnails', [instance.pk])
+
+
+for model in SEARCHABLE_MODELS:
+    signals.post_save.connect(_index_content, sender=model)
+    signals.post_delete.connect(_unindex_content, sender=model)
+
+for signal in (signals.post_save, signals.post_delete):
+    signal.connect(_invalidate_index_sponsors, sender=Sponsor)
+    signal.connect(_invalidate_index_news, sender=NewsItem)
+    signal.connect(_invalidate_getpages, sender=GetPage)
+    signal.connect(_invalidate_getpages, sender=GetPageContent)
+    signal.connect(_invalidate_getpages, sender=Map)
+    signal.connect(_invalidate_diary, sender=DiaryEntry)
+    signal.connect(_invalidate_leaders, sender=Leader)
+    signal.connect(_invalidate_authors, sender=Profile)
+    signal.connect(_invalidate_authors, sender=Avatar)
+    signal.connect(_invalidate_layer_tiles, sender=Layer)
+    signal.connect(_invalidate_map_config, sender=Map)
+    signal.connect(_invalidate_map_layer_config, sender=MapLayer)
+    signal.connect(_invalidate_layer_map_configs, sender=Layer)
+    signal.connect(_invalidate_new_map_config, sender=Service)
+    signal.connect(_invalidate_search, sender=Region)
+    signal.connect(_invalidate_search, sender=TopicCategory)
+
+signals.pre_save.connect(_remember_getpage_name, sender=GetPage)
+
+for model in _PROFILE_FIELDS:
+    signals.pre_save.connect(_invalidate_previous_profile, sender=model)
+    signals.post_save.connect(_invalidate_profile, sender=model)
+    signals.post_delete.connect(_invalidate_profile, sender=model)
+
+# make the avatar thumbnails in the background rather than in the upload
+signals.post_save.disconnect(create_default_thumbnails, sender=Avatar)
+signals.post_save.connect(_avatar_thumbnails, sender=Avatar)
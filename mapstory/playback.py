@@ -0,0 +1,216 @@
+'''
+Server side prefetching of story frames. Instead of the client requesting
+each time step from GeoServer one after the other, the GetMap requests for
+evenly spaced steps of a time range are made concurrently and the results
+streamed back as NDJSON, one line per layer and time step.
+
+Layers anonymous users may view are requested without the viewer's cookie,
+through the tile cache, so their frames are warm for the next viewer. The
+others are requested with the cookie, which bypasses the cache.
+
+Every frame is a GetMap request per layer, so the number of frames has to be
+asked for explicitly, anonymous viewers get fewer than logged in users, and
+each viewer may only start a few prefetches per minute.
+'''
+from django.conf import settings
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.dateparse import parse_datetime
+from geonode.layers.models import Layer
+from mapstory.proxy import GeoServerProxy
+from mapstory.tilecache import TileCacheMiddleware
+from multiprocessing.pool import ThreadPool
+from wsgiref.util import setup_testing_defaults
+import base64
+import datetime
+import json
+import re
+import threading
+import time
+import urllib
+
+
+# GetMap parameters taken from the request, with their defaults
+GETMAP_DEFAULTS = (
+    ('bbox', None),
+    ('width', '256'),
+    ('height', '256'),
+    ('srs', 'EPSG:900913'),
+    ('format', 'image/png'),
+)
+
+_lock = threading.Lock()
+_app = None
+_pool = None
+
+
+def _geoserver():
+    '''(WSGI app, thread pool) shared by all prefetch requests'''
+    global _app, _pool
+    with _lock:
+        if _app is None:
+            _app = TileCacheMiddleware(GeoServerProxy(
+                settings.OGC_SERVER['default']['LOCATION']))
+            _pool = ThreadPool(getattr(settings, 'STORY_PREFETCH_WORKERS', 8))
+    return _app, _pool
+
+
+def parse_time(value):
+    '''a naive UTC datetime from an ISO 8601 year, date or date and time'''
+    if re.match(r'^\d{1,4}$', value):
+        value = '%04d-01-01' % int(value)
+    try:
+        parsed = parse_datetime(value)
+        if parsed is None:
+            date = parse_date(value)
+            parsed = date and datetime.datetime.combine(date, datetime.time())
+    except ValueError:
+        parsed = None
+    if parsed is None:
+        raise ValueError('invalid time %s' % value)
+    if timezone.is_aware(parsed):
+        parsed = timezone.make_naive(parsed, timezone.utc)
+    return parsed
+
+
+def format_time(value):
+    return value.isoformat() + 'Z'
+
+
+def time_steps(start, end, count):
+    '''count instants evenly spaced from start to end, both included'''
+    if count < 2 or start == end:
+        return [format_time(start)]
+    step = (end - start) // (count - 1)
+    return [format_time(start + step * i) for i in range(count - 1)] + [format_time(end)]
+
+
+def request_times(data, max_frames):
+    '''the times of the frames asked for by the start, end and (optional)
+    frames parameters, raising ValueError if they are invalid'''
+    if not data.get('start') or not data.get('end'):
+        raise ValueError('start and end are required')
+    start, end = parse_time(data['start']), parse_time(data['end'])
+    if end < start:
+        raise ValueError('end is before start')
+    if not data.get('frames'):
+        raise ValueError('frames is required')
+    try:
+        count = int(data['frames'])
+    except ValueError:
+        raise ValueError('invalid frames')
+    if not 1 <= count <= max_frames:
+        raise ValueError('frames must be between 1 and %s' % max_frames)
+    return time_steps(start, end, count)
+
+
+def max_frames(user):
+    '''the most frames user may prefetch at once'''
+    if user.is_authenticated():
+        return getattr(settings, 'STORY_PREFETCH_MAX_FRAMES', 50)
+    return getattr(settings, 'STORY_PREFETCH_ANONYMOUS_FRAMES', 10)
+
+
+def allow(request):
+    '''count a prefetch of the requesting user, or address for anonymous
+    users, False when they made STORY_PREFETCH_RATE in the last minute'''
+    if request.user.is_authenticated():
+        viewer = 'user:%s' % request.user.pk
+    else:
+        # nginx passes the client address on
+        viewer = request.META.get('HTTP_X_REAL_IP') or request.META.get('REMOTE_ADDR')
+    key = 'mapstory:prefetch:%s:%d' % (viewer, time.time() // 60)
+    try:
+        count = cache.incr(key)
+    except ValueError:
+        cache.add(key, 1, 60)
+        count = 1
+    return count <= getattr(settings, 'STORY_PREFETCH_RATE', 10)
+
+
+def getmap_params(data):
+    '''the shared GetMap parameters from the request data, raising
+    ValueError if one without a default is missing. Frames larger than
+    STORY_PREFETCH_MAX_SIZE are scaled down, keeping their aspect ratio.'''
+    params = {}
+    for name, default in GETMAP_DEFAULTS:
+        value = data.get(name, default)
+        if value is None:
+            raise ValueError('missing %s' % name)
+        params[name] = value
+    try:
+        width, height = int(params['width']), int(params['height'])
+    except ValueError:
+        raise ValueError('invalid width or height')
+    if width < 1 or height < 1:
+        raise ValueError('invalid width or height')
+    max_size = getattr(settings, 'STORY_PREFETCH_MAX_SIZE', 1024)
+    scale = min(1.0, float(max_size) / max(width, height))
+    params['width'] = str(max(1, int(width * scale)))
+    params['height'] = str(max(1, int(height * scale)))
+    return params
+
+
+def public_layers(layers):
+    '''the names of the layers anonymous users may view'''
+    anonymous = AnonymousUser()
+    names = set(l.name for l in layers)
+    return set(layer.typename for layer in Layer.objects.filter(typename__in=names)
+               if anonymous.has_perm('base.view_resourcebase', obj=layer.resourcebase_ptr))
+
+
+def getmap_query(layer, time, params):
+    query = dict(
+        service='WMS',
+        version='1.1.1',
+        request='GetMap',
+        layers=layer.name,
+        styles=layer.styles or '',
+        transparent='true',
+        time=time,
+    )
+    query.update(params)
+    return urllib.urlencode(sorted(query.items()))
+
+
+def _fetch(args):
+    app, query, cookie, layer, time = args
+    environ = {'PATH_INFO': '/wms', 'QUERY_STRING': query}
+    if cookie:
+        # GeoServer authenticates against the GeoNode session
+        environ['HTTP_COOKIE'] = cookie
+    setup_testing_defaults(environ)
+    response = {}
+
+    def start_response(status, headers, exc_info=None):
+        response['status'] = int(status.split(' ', 1)[0])
+        response['headers'] = dict((k.lower(), v) for k, v in headers)
+
+    body = app(environ, start_response)
+    try:
+        data = ''.join(body)
+    finally:
+        if hasattr(body, 'close'):
+            body.close()
+    return dict(
+        layer=layer.name,
+        time=time,
+        status=response['status'],
+        content_type=response['headers'].get('content-type'),
+        cache=response['headers'].get('x-tile-cache'),
+        data=base64.b64encode(data),
+    )
+
+
+def frames(layers, times, params, cookie=None, public=()):
+    '''yield an NDJSON line per layer and time, in time order, while the
+    requests run concurrently. The cookie is only sent for the layers that
+    are not public.'''
+    app, pool = _geoserver()
+    jobs = [(app, getmap_query(layer, time, params),
+             None if layer.name in public else cookie, layer, time)
+            for time in times for layer in layers]
+    for result in pool.imap(_fetch, jobs):
+        yield json.dumps(result) + '\n'
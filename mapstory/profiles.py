@@ -0,0 +1,69 @@
+'''
+Per profile counts and recent items for the profile page.
+
+The summary of a profile is built with a fixed number of queries whatever
+the user owns, and cached for a short time in the profile's cache group,
+which is invalidated when their maps, layers, diary entries or leader
+membership change (see mapstory.models).
+
+Maps and layers are GeoNode resources with their own permissions. The owner
+and superusers see all of them, everybody else only those anonymous users
+may view, so there are two summaries per profile. Permission changes do
+not save the resources, they show once the summaries expire.
+'''
+from django.conf import settings
+from geonode.layers.models import Layer
+from geonode.maps.models import Map
+from guardian.shortcuts import get_objects_for_user
+from guardian.utils import get_anonymous_user
+from mapstory import cache
+from mapstory.models import DiaryEntry
+from mapstory.models import Leader
+from mapstory.models import profile_group
+
+
+TIMEOUT = getattr(settings, 'PROFILE_SUMMARY_TIMEOUT', 60)
+RECENT = 5
+
+
+def _recent(qs, *fields):
+    return list(qs.values('pk', *fields)[:RECENT])
+
+
+def _public(qs):
+    # maps and layers share their primary keys with their ResourceBase
+    viewable = get_objects_for_user(get_anonymous_user(), 'base.view_resourcebase')
+    return qs.filter(pk__in=viewable.values('pk'))
+
+
+def _summary(profile_id, visibility):
+    maps = Map.objects.filter(owner=profile_id)
+    layers = Layer.objects.filter(owner=profile_id)
+    if visibility == 'public':
+        maps, layers = _public(maps), _public(layers)
+    entries = DiaryEntry.objects.filter(author=profile_id, publish=True)
+    return {
+        'maps': maps.count(),
+        'layers': layers.count(),
+        'diary_entries': entries.count(),
+        'leader': Leader.objects.filter(user=profile_id).exists(),
+        'recent_maps': _recent(maps.order_by('-pk'), 'title'),
+        'recent_layers': _recent(layers.order_by('-pk'), 'title', 'typename'),
+        'recent_diary_entries': _recent(entries.order_by('-date', '-pk'), 'title', 'date'),
+    }
+
+
+def visibility(profile, viewer):
+    '''all or public, the profile's resources viewer may see'''
+    if viewer.is_superuser or viewer.pk == profile.pk:
+        return 'all'
+    return 'public'
+
+
+def summary(profile, viewer):
+    '''{'maps': n, 'layers': n, 'diary_entries': n, 'leader': bool,
+    'recent_maps': [...], ...} of profile as seen by viewer, the recent
+    items as values()'''
+    seen = visibility(profile, viewer)
+    return cache.get_or_build('summary:%s' % seen, lambda: _summary(profile.pk, seen),
+                              timeout=TIMEOUT, group=profile_group(profile.pk))
@@ -0,0 +1,256 @@
+'''
+A streaming WSGI proxy to GeoServer that keeps a pool of keep-alive
+connections to the upstream server. It replaces Paste#proxy in paster.ini:
+
+    [app:gsproxy_app]
+    use = call:mapstory.proxy:make_proxy
+    address = http://localhost:8080/geoserver/
+    pool_size = 20
+
+Response bodies are passed on in chunks as they arrive rather than being
+buffered, and the connection goes back to the pool once the body has been
+read completely.
+'''
+import httplib
+import logging
+import socket
+import threading
+import time
+import urlparse
+
+
+logger = logging.getLogger(__name__)
+
+# headers that only apply to a single hop and must not be forwarded
+HOP_BY_HOP = frozenset((
+    'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization',
+    'te', 'trailers', 'transfer-encoding', 'upgrade',
+))
+
+
+def _default_timeout():
+    from django.conf import settings
+    return settings.OGC_SERVER['default'].get('TIMEOUT', 10)
+
+
+class ConnectionPool(object):
+    '''keep-alive HTTP connections to a single host'''
+
+    def __init__(self, scheme, host, port, size, timeout):
+        self.connection_class = (httplib.HTTPSConnection if scheme == 'https'
+                                 else httplib.HTTPConnection)
+        self.host = host
+        self.port = port
+        self.size = size
+        # None means the OGC_SERVER timeout, looked up on first use because
+        # paste may build this app before the django settings are configured
+        self._timeout = timeout
+        self._idle = []
+        self._lock = threading.Lock()
+
+    @property
+    def timeout(self):
+        if self._timeout is None:
+            self._timeout = _default_timeout()
+        return self._timeout
+
+    def get(self):
+        '''(connection, reused)'''
+        with self._lock:
+            if self._idle:
+                return self._idle.pop(), True
+        return self.connection_class(self.host, self.port, timeout=self.timeout), False
+
+    def put(self, conn):
+        with self._lock:
+            if len(self._idle) < self.size:
+                self._idle.append(conn)
+                return
+        conn.close()
+
+    def clear(self):
+        with self._lock:
+            idle, self._idle = self._idle, []
+        for conn in idle:
+            conn.close()
+
+
+class Metrics(object):
+    '''running totals of the upstream requests'''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.requests = 0
+        self.errors = 0
+        self.reused = 0
+        self.upstream_time = 0.0
+        self.bytes = 0
+
+    def record(self, upstream_time=0, reused=False, error=False):
+        with self._lock:
+            self.requests += 1
+            self.upstream_time += upstream_time
+            self.reused += reused
+            self.errors += error
+
+    def add_bytes(self, count):
+        with self._lock:
+            self.bytes += count
+
+    def stats(self):
+        with self._lock:
+            return dict(
+                requests=self.requests,
+                errors=self.errors,
+                reused_connections=self.reused,
+                bytes=self.bytes,
+                mean_upstream_ms=round(
+                    self.upstream_time / self.requests * 1000, 2) if self.requests else 0,
+            )
+
+
+class _LimitedInput(object):
+    '''reads at most length bytes from the WSGI input'''
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.remaining = length
+
+    def read(self, size=-1):
+        if self.remaining <= 0:
+            return ''
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.stream.read(size)
+        self.remaining -= len(data)
+        return data
+
+
+class _ResponseBody(object):
+    '''iterates the upstream body in chunks, returning the connection to the
+    pool only when the body was read to the end'''
+
+    def __init__(self, proxy, conn, response, chunk_size):
+        self.proxy = proxy
+        self.conn = conn
+        self.response = response
+        self.chunk_size = chunk_size
+        self.done = False
+
+    def __iter__(self):
+        while True:
+            chunk = self.response.read(self.chunk_size)
+            if not chunk:
+                break
+            self.proxy.metrics.add_bytes(len(chunk))
+            yield chunk
+        self.done = True
+
+    def close(self):
+        if self.conn is None:
+            return
+        if self.done and not self.response.will_close:
+            self.proxy.pool.put(self.conn)
+        else:
+            self.conn.close()
+        self.conn = None
+
+
+def _response_headers(message):
+    '''(name, value) of every header line of an httplib message. Unlike
+    getheaders() repeated headers such as Set-Cookie are kept apart.'''
+    headers = []
+    for line in message.headers:
+        if line[:1] in ' \t' and headers:
+            # a continuation of the previous header
+            name, value = headers[-1]
+            headers[-1] = name, '%s %s' % (value, line.strip())
+        else:
+            name, _, value = line.partition(':')
+            headers.append((name.strip(), value.strip()))
+    return headers
+
+
+class GeoServerProxy(object):
+
+    def __init__(self, address, timeout=None, pool_size=10, chunk_size=64 * 1024):
+        parsed = urlparse.urlsplit(address)
+        self.prefix = parsed.path.rstrip('/')
+        self.host_header = parsed.netloc
+        self.chunk_size = chunk_size
+        self.pool = ConnectionPool(
+            parsed.scheme, parsed.hostname, parsed.port, pool_size, timeout)
+        self.metrics = Metrics()
+
+    def _request_headers(self, environ):
+        headers = {}
+        for key, value in environ.items():
+            if key.startswith('HTTP_'):
+                name = key[5:].replace('_', '-').lower()
+                if name not in HOP_BY_HOP:
+                    headers[name] = value
+        for key in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+            if environ.get(key):
+                headers[key.replace('_', '-').lower()] = environ[key]
+        headers['host'] = self.host_header
+        headers['x-forwarded-host'] = environ.get('HTTP_HOST', '')
+        headers['x-forwarded-proto'] = environ.get('wsgi.url_scheme', 'http')
+        forwarded_for = environ.get('HTTP_X_FORWARDED_FOR')
+        remote = environ.get('REMOTE_ADDR', '')
+        headers['x-forwarded-for'] = (
+            '%s, %s' % (forwarded_for, remote) if forwarded_for else remote)
+        return headers
+
+    def _send(self, method, url, body, headers):
+        '''send the request, retrying when a pooled connection turns out to
+        have been closed by the server'''
+        while True:
+            conn, reused = self.pool.get()
+            start = time.time()
+            try:
+                conn.request(method, url, body, headers)
+                response = conn.getresponse()
+            except (httplib.HTTPException, socket.error):
+                conn.close()
+                # a body stream cannot be replayed
+                if reused and body is None:
+                    continue
+                self.metrics.record(error=True)
+                raise
+            upstream_time = time.time() - start
+            self.metrics.record(upstream_time, reused)
+            logger.debug('geoserver %s %s %s in %.1fms', method, url,
+                         response.status, upstream_time * 1000)
+            return conn, response, upstream_time
+
+    def __call__(self, environ, start_response):
+        url = self.prefix + (environ.get('PATH_INFO') or '/')
+        if environ.get('QUERY_STRING'):
+            url += '?' + environ['QUERY_STRING']
+        method = environ['REQUEST_METHOD']
+        length = int(environ.get('CONTENT_LENGTH') or 0)
+        body = _LimitedInput(environ['wsgi.input'], length) if length else None
+
+        try:
+            conn, response, upstream_time = self._send(
+                method, url, body, self._request_headers(environ))
+        except (httplib.HTTPException, socket.error) as e:
+            logger.warning('geoserver request %s %s failed: %s', method, url, e)
+            start_response('502 Bad Gateway', [('Content-Type', 'text/plain')])
+            return ['Could not connect to GeoServer: %s' % e]
+
+        headers = [(name, value) for name, value in _response_headers(response.msg)
+                   if name.lower() not in HOP_BY_HOP]
+        headers.append(('Server-Timing', 'geoserver;dur=%.1f' % (upstream_time * 1000)))
+        start_response('%s %s' % (response.status, response.reason), headers)
+        return _ResponseBody(self, conn, response, self.chunk_size)
+
+
+def make_proxy(global_conf, address, timeout=None, pool_size=10, chunk_size=64 * 1024):
+    '''paste app factory'''
+    return GeoServerProxy(
+        address,
+        timeout=float(timeout) if timeout is not None else None,
+        pool_size=int(pool_size),
+        chunk_size=int(chunk_size),
+    )
@@ -0,0 +1,70 @@
+'''
+Ranked full text search of the editorial content indexed in SearchDocument.
+
+On PostgreSQL documents are matched and ranked with text search, backed by
+the index in sql/searchdocument.postgresql_psycopg2.sql. Other databases,
+like the SQLite development database, match every term with LIKE and rank by
+term frequency in Python. That loads every matching document for each search,
+which is fine for development data only.
+'''
+from django.db import connection
+from django.db.models import Q
+from mapstory.models import SearchDocument
+import datetime
+import re
+
+
+_VECTOR = ("to_tsvector('english', mapstory_searchdocument.title || ' ' || "
+           "mapstory_searchdocument.text)")
+_QUERY = "plainto_tsquery('english', %s)"
+
+
+def terms(query):
+    return [t for t in re.split(r'\W+', query.lower(), flags=re.UNICODE) if t]
+
+
+def snippet(text, words, length=200):
+    '''length characters of text around the first of the words found'''
+    lowered = text.lower()
+    found = [i for i in (lowered.find(w) for w in words) if i >= 0]
+    start = max(0, min(found) - length // 4) if found else 0
+    return text[start:start + length].strip()
+
+
+def _published():
+    return SearchDocument.objects.filter(
+        publish=True, date__lte=datetime.datetime.now()).select_related('content_type')
+
+
+def _postgres_search(query, offset, limit):
+    docs = _published().extra(
+        select={'rank': 'ts_rank(%s, %s)' % (_VECTOR, _QUERY)},
+        select_params=[query],
+        where=['%s @@ %s' % (_VECTOR, _QUERY)],
+        params=[query],
+        order_by=['-rank', '-date'],
+    )
+    return list(docs[offset:offset + limit])
+
+
+def _fallback_search(query, offset, limit):
+    words = terms(query)
+    docs = _published()
+    for word in words:
+        docs = docs.filter(Q(title__icontains=word) | Q(text__icontains=word))
+    ranked = []
+    for doc in docs:
+        title, text = doc.title.lower(), doc.text.lower()
+        doc.rank = sum(text.count(w) + 5 * title.count(w) for w in words)
+        ranked.append(doc)
+    ranked.sort(key=lambda d: (d.rank, d.date), reverse=True)
+    return ranked[offset:offset + limit]
+
+
+def search(query, offset=0, limit=20):
+    '''published SearchDocuments matching query, best first, with a rank'''
+    if not terms(query):
+        return []
+    if connection.vendor == 'postgresql':
+        return _postgres_search(query, offset, limit)
+    return _fallback_search(query, offset, limit)
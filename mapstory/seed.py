@@ -0,0 +1,308 @@
+'''
+Synthetic content for development and benchmarking. Everything is generated
+from a seeded random so repeated runs produce the same data.
+
+seed() creates a small data set one object at a time, through save() and the
+signals. bulk_seed() loads the millions of rows of a load test environment
+with batched bulk inserts, spread over worker processes; it skips save() and
+the signals, so the search index has to be rebuilt afterwards.
+'''
+from django.contrib.auth.hashers import make_password
+from django.contrib.webdesign import lorem_ipsum
+from django.core.files.base import ContentFile
+from django.db import connection
+from django.db import transaction
+from geonode.maps.models import Map
+from geonode.maps.models import MapLayer
+from geonode.people.models import Profile
+from itertools import product
+from mapstory.models import DiaryEntry
+from mapstory.models import GetPage
+from mapstory.models import GetPageContent
+from mapstory.models import Leader
+from mapstory.models import NewsItem
+from mapstory.models import Sponsor
+from mapstory.models import _stamp
+from mapstory.db import pool
+from multiprocessing import Pool
+import datetime
+import random
+
+
+FIRST_NAMES = ['George', 'John', 'Tom', 'Jim', 'Andy']
+LAST_NAMES = ['Jackson', 'Adams', 'Monroe', 'Washington', 'Jefferson']
+
+# a 1x1 transparent gif
+_ICON = ('GIF89a\x01\x00\x01\x00\x80\x00\x00\x00\x00\x00\xff\xff\xff!\xf9\x04'
+         '\x01\x00\x00\x00\x00,\x00\x00\x00\x00\x01\x00\x01\x00\x00\x02\x02D'
+         '\x01\x00;')
+
+
+def names(n, start=0):
+    '''n (first, last) pairs, numbering repeats once the combinations run out'''
+    pairs = list(product(FIRST_NAMES, LAST_NAMES))
+    for i in range(start, start + n):
+        first, last = pairs[i % len(pairs)]
+        suffix = i // len(pairs)
+        yield first, last + (str(suffix) if suffix else '')
+
+
+def textile_words(n):
+    '''lorem ipsum sprinkled with textile markup'''
+    content = lorem_ipsum.words(n, common=False).split(' ')
+    for r in random.sample(range(len(content)), min(10, len(content))):
+        content[r] = content[r].join(random.sample('*_+@', 1)[0] * 2)
+    return ' '.join(content)
+
+
+def make_users(n):
+    return [
+        Profile.objects.create(username=(first + last).lower(),
+                               first_name=first, last_name=last)
+        for first, last in names(n)
+    ]
+
+
+def make_leaders(profiles=None):
+    if profiles is None:
+        profiles = Profile.objects.all()
+    return [Leader.objects.create(content=textile_words(50), user=p)
+            for p in profiles]
+
+
+def make_diary_entries(n, authors):
+    start = datetime.datetime(2014, 1, 1)
+    return [
+        DiaryEntry.objects.create(
+            title=lorem_ipsum.words(4, common=False)[:32],
+            content=textile_words(200),
+            author=authors[i % len(authors)],
+            publish=random.random() > .1,
+            date=start + datetime.timedelta(hours=i),
+        )
+        for i in range(n)
+    ]
+
+
+def make_news_items(n):
+    start = datetime.datetime(2014, 1, 1)
+    return [
+        NewsItem.objects.create(
+            title=lorem_ipsum.words(6, common=False)[:64],
+            content=textile_words(100),
+            date=start + datetime.timedelta(days=i),
+        )
+        for i in range(n)
+    ]
+
+
+def make_sponsors(n):
+    sponsors = []
+    for i in range(n):
+        sponsor = Sponsor(name='Sponsor %d' % i, link='http://sponsor%d.org' % i,
+                          description=lorem_ipsum.words(10), order=i)
+        sponsor.icon.save('sponsor%d.gif' % i, ContentFile(_ICON), save=False)
+        sponsor.save()
+        sponsors.append(sponsor)
+    return sponsors
+
+
+def make_getpage_contents(n):
+    pages = list(GetPage.objects.all())
+    return [
+        GetPageContent.objects.create(
+            title=lorem_ipsum.words(4, common=False)[:64],
+            content=textile_words(100),
+            main_link='http://www.youtube.com/watch?v=%d' % i,
+            page=pages[i % len(pages)],
+            publish=True,
+            order=i,
+        )
+        for i in range(n)
+    ] if pages else []
+
+
+def make_maps(n, owners, layers=5):
+    '''maps of layers that do not exist in GeoServer, enough to build their
+    configuration'''
+    maps = []
+    for i in range(n):
+        map_obj = Map.objects.create(
+            title=lorem_ipsum.words(4, common=False)[:64],
+            abstract=lorem_ipsum.words(20),
+            owner=owners[i % len(owners)],
+            zoom=3, projection='EPSG:900913', center_x=0, center_y=0,
+        )
+        for j in range(layers):
+            MapLayer.objects.create(
+                map=map_obj, stack_order=j, name='geonode:layer%d_%d' % (i, j),
+                format='image/png', transparent=True, visibility=True,
+                layer_params='{}', source_params='{}', local=True,
+            )
+        maps.append(map_obj)
+    return maps
+
+
+def seed(users=25, entries=100, news=10, sponsors=10, contents=10, maps=5, seed=0):
+    random.seed(seed)
+    profiles = make_users(users)
+    make_leaders(profiles)
+    make_diary_entries(entries, profiles)
+    make_news_items(news)
+    make_sponsors(sponsors)
+    make_getpage_contents(contents)
+    make_maps(maps, profiles)
+
+
+def _bulk_users(start, n, context):
+    return [Profile(username=(first + last).lower(), first_name=first,
+                    last_name=last, password=context['password'])
+            for first, last in names(n, start)]
+
+
+def _bulk_diary_entries(start, n, context):
+    authors = _pks(Profile)
+    begin = datetime.datetime(2014, 1, 1)
+    return [
+        DiaryEntry(
+            title=lorem_ipsum.words(4, common=False)[:32],
+            content=textile_words(200),
+            author_id=authors[i % len(authors)],
+            publish=random.random() > .1,
+            date=begin + datetime.timedelta(minutes=i),
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def _bulk_news_items(start, n, context):
+    begin = datetime.datetime(2014, 1, 1)
+    return [
+        NewsItem(
+            title=lorem_ipsum.words(6, common=False)[:64],
+            content=textile_words(100),
+            date=begin + datetime.timedelta(hours=i),
+        )
+        for i in range(start, start + n)
+    ]
+
+
+def _bulk_sponsors(start, n, context):
+    # every sponsor shares the icon written by bulk_seed
+    return [
+        Sponsor(name='Sponsor %d' % i, link='http://sponsor%d.org' % i,
+                description=lorem_ipsum.words(10), order=i,
+                icon=context['icon'], stamp=context['icon_stamp'])
+        for i in range(start, start + n)
+    ]
+
+
+def _bulk_getpage_contents(start, n, context):
+    pages = _pks(GetPage)
+    return [
+        GetPageContent(
+            title=lorem_ipsum.words(4, common=False)[:64],
+            content=textile_words(100),
+            main_link='http://www.youtube.com/watch?v=%d' % i,
+            page_id=pages[i % len(pages)],
+            publish=True,
+            order=i,
+        )
+        for i in range(start, start + n)
+    ] if pages else []
+
+
+# in dependency order, diary entries need their authors
+BULK_MODELS = [
+    ('users', Profile, _bulk_users),
+    ('entries', DiaryEntry, _bulk_diary_entries),
+    ('news', NewsItem, _bulk_news_items),
+    ('sponsors', Sponsor, _bulk_sponsors),
+    ('contents', GetPageContent, _bulk_getpage_contents),
+]
+
+_builders = dict((name, (model, build)) for name, model, build in BULK_MODELS)
+# per process, rows referenced by foreign keys are loaded before the models
+# referencing them and are not changed afterwards
+_pk_lists = {}
+_worker = False
+
+
+def _pks(model):
+    if model not in _pk_lists:
+        _pk_lists[model] = list(model.objects.order_by('pk')
+                                .values_list('pk', flat=True))
+    return _pk_lists[model]
+
+
+def _init_worker():
+    global _worker
+    _worker = True
+
+
+def _bulk_batch(args):
+    name, start, n, seed, render, context = args
+    model, build = _builders[name]
+    # every batch has its own seed, the data does not depend on which worker
+    # inserts it or in which order
+    random.seed('%d:%s:%d' % (seed, name, start))
+    objs = build(start, n, context)
+    if render and hasattr(model, 'render_html'):
+        for obj in objs:
+            obj.render_html()
+    try:
+        with transaction.atomic():
+            model.objects.bulk_create(objs)
+    finally:
+        if _worker:
+            connection.close()
+    return len(objs)
+
+
+def _bulk_context(name):
+    if name == 'users':
+        # one hash for everybody, hashing millions of passwords is slow
+        return {'password': make_password('password')}
+    if name == 'sponsors':
+        # stamped before saving, the stamp is part of the icon name
+        sponsor = Sponsor(stamp=_stamp(_ICON))
+        sponsor.icon.save('bulk.gif', ContentFile(_ICON), save=False)
+        return {'icon': sponsor.icon.name, 'icon_stamp': sponsor.stamp}
+    return {}
+
+
+def bulk_seed(counts, batch_size=1000, workers=1, seed=0, render=True,
+              progress=None):
+    '''insert counts[name] rows of each of the BULK_MODELS in batches of
+    batch_size, with workers processes per model. progress(name, inserted) is
+    called after every batch.
+
+    Parallel workers need PostgreSQL, SQLite locks the database for every
+    writer. Without render the textile is rendered on the first view.'''
+    _pk_lists.clear()
+    workers_pool = None
+    try:
+        for name, model, build in BULK_MODELS:
+            total = counts.get(name, 0)
+            if not total:
+                continue
+            context = _bulk_context(name)
+            batches = [(name, start, min(batch_size, total - start), seed,
+                        render, context)
+                       for start in range(0, total, batch_size)]
+            if workers > 1:
+                if workers_pool is None:
+                    pool.close_all()
+                    workers_pool = Pool(workers, _init_worker)
+                results = workers_pool.imap_unordered(_bulk_batch, batches)
+            else:
+                results = (_bulk_batch(batch) for batch in batches)
+            inserted = 0
+            for n in results:
+                inserted += n
+                if progress:
+                    progress(name, inserted)
+    finally:
+        if workers_pool is not None:
+            workers_pool.close()
+            workers_pool.join()
@@ -0,0 +1,279 @@
+# -*- coding: utf-8 -*-
+#########################################################################
+#
+# Copyright (C) 2012 OpenPlans
+#
+# This program is free software: you can redistribute it and/or modify
+# it under the terms of the GNU General Public License as published by
+# the Free Software Foundation, either version 3 of the License, or
+# (at your option) any later version.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE. See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program. If not, see <http://www.gnu.org/licenses/>.
+#
+#########################################################################
+
+# Django settings for the GeoNode project.
+import json
+import os
+from geonode.settings import *
+#
+# General Django development settings
+#
+
+SITENAME = 'MapStory'
+
+# Defines the directory that contains the settings file as the LOCAL_ROOT
+# It is used for relative settings elsewhere.
+LOCAL_ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), '..'))
+
+WSGI_APPLICATION = "mapstory.wsgi.application"
+
+STATICFILES_DIRS = [
+    os.path.join(LOCAL_ROOT, "static"),
+    ("maploom/vendor", LOCAL_ROOT + "/../../MapLoom/vendor"),
+    ("maploom", LOCAL_ROOT + "/../../MapLoom/build"),
+] + STATICFILES_DIRS
+
+STATIC_ROOT = os.path.join(LOCAL_ROOT, "static_root")
+
+# collectstatic fingerprints and precompresses every file, see mapstory.storage
+STATICFILES_STORAGE = 'mapstory.storage.ManifestStaticFilesStorage'
+MEDIA_ROOT = os.path.join(LOCAL_ROOT, "uploaded")
+
+# Note that Django automatically includes the "templates" dir in all the
+# INSTALLED_APPS, se there is no need to add maps/templates or admin/templates
+TEMPLATE_DIRS = (
+    os.path.join(LOCAL_ROOT, "templates"),
+) + TEMPLATE_DIRS
+
+# Location of url mappings
+ROOT_URLCONF = 'mapstory.urls'
+
+# Location of locale files
+LOCALE_PATHS = (
+    os.path.join(LOCAL_ROOT, 'locale'),
+    ) + LOCALE_PATHS
+
+# Defines settings for development
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': os.path.join(LOCAL_ROOT, 'development.db'),
+    },
+}
+
+INSTALLED_APPS += (
+    'mapstory',
+    'django.contrib.webdesign',
+    'geonode.contrib.geogig'
+)
+
+TEMPLATE_CONTEXT_PROCESSORS += (
+    'mapstory.context_processors.context',
+)
+
+MIDDLEWARE_CLASSES = (
+    'mapstory.instrumentation.InstrumentationMiddleware',
+) + MIDDLEWARE_CLASSES
+
+# Time SQL, template rendering and textile for a sample of requests and report
+# it in Server-Timing headers and the mapstory.instrumentation log
+INSTRUMENTATION_ENABLED = False
+INSTRUMENTATION_SAMPLE_RATE = 0.05
+
+OGC_SERVER = {
+    'default' : {
+        'BACKEND' : 'geonode.geoserver',
+        'LOCATION' : 'http://localhost:8080/geoserver/',
+        # PUBLIC_LOCATION needs to be kept like this because in dev mode
+        # the proxy won't work and the integration tests will fail
+        # the entire block has to be overridden in the local_settings
+        'PUBLIC_LOCATION' : 'http://localhost:8000/geoserver/',
+        'USER' : 'admin',
+        'PASSWORD' : 'geoserver',
+        'MAPFISH_PRINT_ENABLED' : True,
+        'PRINT_NG_ENABLED' : True,
+        'GEONODE_SECURITY_ENABLED' : True,
+        'GEOGIT_ENABLED' : True,
+        'WMST_ENABLED' : False,
+        'BACKEND_WRITE_ENABLED': True,
+        'WPS_ENABLED' : True,
+        # Set to name of database in DATABASES dictionary to enable
+        'DATASTORE': '', #'datastore',
+        'TIMEOUT': 10  # number of seconds to allow for HTTP requests
+    }
+}
+
+DEBUG_STATIC = True
+
+REMOTE_CONTENT_URL = 'http://mapstory.dev.boundlessgeo.com/mapstory-assets'
+
+DATABASE_PASSWORD = None
+
+# When DATABASE_PASSWORD is set, connections to both postgres databases are
+# pooled per process, see mapstory.db.pool for the options
+DATABASE_POOLING = True
+DATABASE_POOL = {
+    'SIZE': 5,
+    'MAX_OVERFLOW': 5,
+    'MAX_AGE': 600,
+    'TIMEOUT': 10,
+    'HEALTH_CHECK_INTERVAL': 30,
+}
+
+# Where to load mapstory-assets from. If True, use /static/assets
+# otherwise use REMOTE_CONTENT_URL
+# To use local, ensure that the mapstory-assets repository is checked out in
+# this project's parent (i.e. ../mapstory-assets)
+LOCAL_CONTENT = False
+
+GEOGIT_DATASTORE_NAME = 'geogit'
+
+# Disk cache of GetMap/GetTile responses in front of the GeoServer proxy
+TILE_CACHE = {
+    'LOCATION': os.path.join(LOCAL_ROOT, 'tilecache'),
+    'MAX_SIZE': 1024 ** 3,
+}
+
+# Sponsor icons are shown in 120px boxes, variants are made for 1x, 2x and
+# 3x screens by a background job
+SPONSOR_ICON_SIZES = (120, 240, 360)
+
+# Avatar sizes the templates show, at 1x and 2x
+AUTO_GENERATE_AVATAR_SIZES = tuple(sorted(set(AUTO_GENERATE_AVATAR_SIZES) | set((30, 60, 140, 280))))
+
+# Concurrent GeoServer requests, the most time steps for logged in and
+# anonymous users, the largest frame side in pixels and the prefetches a
+# viewer may start per minute of a story frame prefetch
+STORY_PREFETCH_WORKERS = 8
+STORY_PREFETCH_MAX_FRAMES = 50
+STORY_PREFETCH_ANONYMOUS_FRAMES = 10
+STORY_PREFETCH_MAX_SIZE = 1024
+STORY_PREFETCH_RATE = 10
+
+# Seconds the counts and recent items of a profile page are cached, they are
+# also invalidated when the user's content changes
+PROFILE_SUMMARY_TIMEOUT = 60
+
+# Local overrides are resolved from an absolute path (or MAPSTORY_LOCAL_SETTINGS)
+# so the result does not depend on the working directory
+LOCAL_SETTINGS = os.environ.get('MAPSTORY_LOCAL_SETTINGS',
+                                os.path.join(LOCAL_ROOT, 'settings', 'local_settings.py'))
+if os.path.exists(LOCAL_SETTINGS):
+    execfile(LOCAL_SETTINGS, globals())
+
+# Any setting can also be overridden from the environment, for example
+# MAPSTORY_SETTING_DATABASE_PASSWORD=secret or MAPSTORY_SETTING_DEBUG=false.
+# Values are parsed as JSON and fall back to plain strings.
+for _name, _value in os.environ.items():
+    if _name.startswith('MAPSTORY_SETTING_'):
+        try:
+            _value = json.loads(_value)
+        except ValueError:
+            pass
+        globals()[_name[len('MAPSTORY_SETTING_'):]] = _value
+
+# The cached pages, their invalidations and the statistics of mapstory.cache
+# are shared by the gunicorn and job workers through memcached, DEBUG runs
+# keep them in process memory
+if 'CACHES' not in globals():
+    CACHES = {'default': {
+        'BACKEND': 'django.core.cache.backends.memcached.MemcachedCache',
+        'LOCATION': '127.0.0.1:11211',
+    }}
+    if DEBUG:
+        CACHES = {'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+
+# Background jobs (mapstory.jobs) are run by `manage.py run_worker`, in
+# DEBUG they run right away unless JOBS_EAGER is set to False
+JOBS_EAGER = globals().get('JOBS_EAGER', DEBUG)
+# finished jobs are deleted after JOBS_KEEP_DAYS, running jobs are requeued
+# after JOBS_TIMEOUT seconds as their worker must have died
+JOBS_KEEP_DAYS = 7
+JOBS_TIMEOUT = 60 * 60
+
+# Outside DEBUG templates are parsed once per process and kept, the WSGI
+# application compiles all of them at startup (see mapstory.template_cache)
+CACHED_TEMPLATES = globals().get('CACHED_TEMPLATES', not DEBUG)
+if CACHED_TEMPLATES:
+    TEMPLATE_LOADERS = (
+        ('django.template.loaders.cached.Loader', TEMPLATE_LOADERS),
+    )
+
+#@todo remove this hack once maploom can deal with other config
+# have to put this after local_settings or any adjustments to OGC_SERVER will
+# not get picked up
+MAP_BASELAYERS = [
+    {
+        "source": {
+            "ptype": "gxp_wmscsource",
+            "url": OGC_SERVER['default']['PUBLIC_LOCATION'] + "wms",
+            "restUrl": "/gs/rest",
+            "name": "local geoserver"
+        }
+    },
+    {
+        "source": {"ptype": "gxp_osmsource", "name": "OpenStreetMap"},
+        "type": "OpenLayers.Layer.OSM",
+        "name": "mapnik",
+        "title": "OpenStreetMap",
+        "args": ["OpenStreetMap"],
+        "visibility": True,
+        "fixed": True,
+        "group":"background"
+    }
+]
+
+if LOCAL_CONTENT:
+    REMOTE_CONTENT_URL = STATIC_URL + 'assets'
+
+if DATABASE_PASSWORD:
+    if DATABASE_POOLING:
+        # Django hands connections back to the pool after each request
+        _engines = 'mapstory.db.backends.postgresql_psycopg2', 'mapstory.db.backends.postgis'
+        _conn_max_age = 0
+    else:
+        _engines = 'django.db.backends.postgresql_psycopg2', 'django.contrib.gis.db.backends.postgis'
+        _conn_max_age = DATABASE_POOL['MAX_AGE']
+    DATABASES = {
+        'default': {
+            'ENGINE': _engines[0],
+            'NAME': 'mapstory',
+            'USER': 'mapstory',
+            'PASSWORD': DATABASE_PASSWORD,
+            'HOST' : 'localhost',
+            'PORT' : '5432',
+            'CONN_MAX_AGE': _conn_max_age,
+            'POOL': DATABASE_POOL,
+        },
+        'datastore' : {
+            'ENGINE': _engines[1],
+            'NAME': 'mapstory_data',
+            'USER' : 'mapstory',
+            'PASSWORD' : DATABASE_PASSWORD,
+            'HOST' : 'localhost',
+            'PORT' : '5432',
+            'CONN_MAX_AGE': _conn_max_age,
+            'POOL': DATABASE_POOL,
+        }
+    }
+
+    OGC_SERVER['default']['DATASTORE'] = 'datastore'
+
+    UPLOADER = {
+        'BACKEND': 'geonode.importer',
+        'OPTIONS': {
+            'TIME_ENABLED': True,
+            'GEOGIT_ENABLED': True,
+        }
+    }
+
+    USE_BIG_DATE = True
+
+    GEOGIT_DATASTORE_NAME = 'geogit'
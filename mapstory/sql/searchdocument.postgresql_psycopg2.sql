@@ -0,0 +1,3 @@
+-- the expression has to match the one mapstory.search queries with
+CREATE INDEX mapstory_searchdocument_fts ON mapstory_searchdocument
+    USING gin(to_tsvector('english', title || ' ' || text));
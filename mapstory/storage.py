@@ -0,0 +1,125 @@
+'''
+Static files storage that fingerprints every collected file and records the
+names in a manifest, so pages can reference assets that are cached forever.
+
+collectstatic writes name.<hash>.ext next to each file, a gzip (and, when the
+brotli module is installed, a brotli) variant of the compressible ones for
+nginx's gzip_static and brotli_static, and staticfiles.json mapping the
+original names to the hashed ones. The manifest is read once per process and
+used by {% static %} from django.contrib.staticfiles.
+'''
+from django.contrib.staticfiles.storage import CachedFilesMixin
+from django.contrib.staticfiles.storage import StaticFilesStorage
+from django.contrib.staticfiles.utils import matches_patterns
+from django.core.files.base import ContentFile
+import gzip
+import json
+import logging
+import StringIO
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+
+logger = logging.getLogger(__name__)
+
+
+class _Manifest(dict):
+    '''the subset of the cache API CachedFilesMixin uses, keyed by name'''
+
+    def set(self, key, value):
+        self[key] = value
+
+    def set_many(self, mapping):
+        self.update(mapping)
+
+
+def gzip_compress(data):
+    out = StringIO.StringIO()
+    # a fixed mtime keeps the output the same for the same input
+    with gzip.GzipFile(fileobj=out, mode='wb', compresslevel=9, mtime=0) as f:
+        f.write(data)
+    return out.getvalue()
+
+
+class ManifestStaticFilesStorage(CachedFilesMixin, StaticFilesStorage):
+    manifest_name = 'staticfiles.json'
+    compress_patterns = ('*.css', '*.js', '*.json', '*.svg', '*.html', '*.txt',
+                         '*.xml', '*.ttf', '*.eot', '*.otf')
+    # smaller files do not win much over the extra request headers
+    min_compress_size = 256
+
+    def __init__(self, *args, **kwargs):
+        super(ManifestStaticFilesStorage, self).__init__(*args, **kwargs)
+        self.cache = self.load_manifest()
+        # names url() did not find, looked up on disk once per process
+        self.missing = set()
+
+    def load_manifest(self):
+        try:
+            with self.open(self.manifest_name) as fp:
+                return _Manifest(json.loads(fp.read())['paths'])
+        except (IOError, OSError, ValueError, KeyError):
+            return _Manifest()
+
+    def save_manifest(self):
+        if self.exists(self.manifest_name):
+            self.delete(self.manifest_name)
+        self._save(self.manifest_name, ContentFile(
+            json.dumps({'paths': self.cache}, indent=1, sort_keys=True)))
+
+    def cache_key(self, name):
+        return name
+
+    def url(self, name, force=False):
+        if name in self.missing:
+            return super(CachedFilesMixin, self).url(name)
+        try:
+            return super(ManifestStaticFilesStorage, self).url(name, force)
+        except ValueError:
+            # a missing file should not break the page referencing it
+            logger.warning('static file %s not found, not fingerprinted', name)
+            self.missing.add(name)
+            return super(CachedFilesMixin, self).url(name)
+
+    def manifest_url(self, name):
+        '''the url of the hashed name, None if name was not collected'''
+        hashed_name = self.cache.get(name)
+        if hashed_name is None:
+            return None
+        return super(CachedFilesMixin, self).url(hashed_name)
+
+    def _save_variant(self, name, data):
+        if self.exists(name):
+            self.delete(name)
+        self._save(name, ContentFile(data))
+
+    def compress(self, name):
+        '''write the compressed variants of name if they are smaller'''
+        with self.open(name) as fp:
+            data = fp.read()
+        if len(data) < self.min_compress_size:
+            return
+        variants = [('.gz', gzip_compress)]
+        if brotli is not None:
+            variants.append(('.br', brotli.compress))
+        for suffix, compress in variants:
+            compressed = compress(data)
+            if len(compressed) < len(data):
+                self._save_variant(name + suffix, compressed)
+
+    def post_process(self, paths, dry_run=False, **options):
+        if dry_run:
+            return
+        self.cache = _Manifest()
+        self.missing = set()
+        processed = super(ManifestStaticFilesStorage, self).post_process(
+            paths, dry_run, **options)
+        for name, hashed_name, was_processed in processed:
+            if (hashed_name and matches_patterns(hashed_name, self.compress_patterns)
+                    and (was_processed or not self.exists(hashed_name + '.gz'))):
+                self.compress(hashed_name)
+            yield name, hashed_name, was_processed
+        self.save_manifest()
@@ -0,0 +1,57 @@
+'''
+Jobs run by the mapstory.jobs workers. They take primary keys rather than
+objects, so they work on the rows as they are when the job runs.
+'''
+from avatar.models import Avatar
+from avatar.settings import AUTO_GENERATE_AVATAR_SIZES
+from django.db.models import get_model
+from django.utils import timezone
+from mapstory import cache
+from mapstory import jobs
+from mapstory.models import SEARCHABLE_MODELS
+from mapstory.models import SearchDocument
+from mapstory.models import Sponsor
+from mapstory.models import _stamp_file
+from mapstory.models import invalidate_content
+
+
+def _objects(label, pks):
+    return get_model(*label.split('.')).objects.filter(pk__in=pks)
+
+
+def index_content(label, pks):
+    for obj in _objects(label, pks):
+        SearchDocument.index(obj)
+
+
+def rerender_textile(label, pks):
+    model = get_model(*label.split('.'))
+    touched = []
+    for obj in _objects(label, pks):
+        obj.render_html()
+        model.objects.filter(pk=obj.pk).update(
+            html_cache=obj.html_cache, html_stamp=obj.html_stamp, modified=timezone.now())
+        touched.append(obj.pk)
+    # update() sends no signals
+    invalidate_content(model)
+    if model in SEARCHABLE_MODELS and touched:
+        jobs.enqueue('mapstory.tasks.index_content', label, touched)
+
+
+def restamp_sponsors(pks):
+    for sponsor in Sponsor.objects.filter(pk__in=pks).exclude(icon=''):
+        Sponsor.objects.filter(pk=sponsor.pk).update(
+            stamp=_stamp_file(sponsor.icon), modified=timezone.now())
+    # update() sends no signals
+    cache.invalidate('index:sponsors')
+
+
+def make_sponsor_thumbnails(pks):
+    for sponsor in Sponsor.objects.filter(pk__in=pks).exclude(icon=''):
+        sponsor.make_thumbnails()
+
+
+def make_avatar_thumbnails(pks):
+    for avatar in Avatar.objects.filter(pk__in=pks):
+        for size in AUTO_GENERATE_AVATAR_SIZES:
+            avatar.create_thumbnail(size)
@@ -0,0 +1,58 @@
+'''
+Compiling the mapstory templates ahead of the first request.
+
+Outside DEBUG the template loaders are wrapped in Django's cached loader (see
+CACHED_TEMPLATES in the settings), which keeps every template it parsed for
+the life of the process. warm() loads all of mapstory/templates through it
+when a worker starts; check_templates compiles them at deploy time and fails
+on any that do not.
+'''
+from django.conf import settings
+from django.template.loader import get_template
+import logging
+import os
+import time
+
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_ROOT = os.path.join(os.path.dirname(__file__), 'templates')
+_EXTENSIONS = ('.html', '.txt')
+_CACHED_LOADER = 'django.template.loaders.cached.Loader'
+
+
+def template_names(root=TEMPLATE_ROOT):
+    '''the names of the templates under root, sorted'''
+    names = []
+    for path, dirs, files in os.walk(root):
+        for name in files:
+            if name.endswith(_EXTENSIONS):
+                names.append(os.path.relpath(os.path.join(path, name), root))
+    return sorted(names)
+
+
+def compile_templates(names=None):
+    '''{name: error} of the templates that fail to load or parse'''
+    errors = {}
+    for name in template_names() if names is None else names:
+        try:
+            get_template(name)
+        except Exception as e:
+            errors[name] = '%s: %s' % (type(e).__name__, e)
+    return errors
+
+
+def cached_loader_enabled():
+    return any(isinstance(loader, (list, tuple)) and loader[0] == _CACHED_LOADER
+               for loader in settings.TEMPLATE_LOADERS)
+
+
+def warm():
+    '''parse every template into the cached loader, a no-op without it'''
+    if not cached_loader_enabled():
+        return
+    start = time.time()
+    errors = compile_templates()
+    for name, error in sorted(errors.items()):
+        logger.error('template %s does not compile, %s', name, error)
+    logger.info('compiled templates in %.2fs', time.time() - start)
@@ -1,15 +1,65 @@
+from avatar.settings import AVATAR_DEFAULT_SIZE
+from avatar.settings import AVATAR_GRAVATAR_BACKUP
+from avatar.settings import AVATAR_GRAVATAR_DEFAULT
+from avatar.settings import AVATAR_GRAVATAR_SSL
+from avatar.util import get_default_avatar_url
 from django import template
-from django.conf import settings
-from mapstory.utils import Link
+from django.utils.html import escape
+from mapstory import thumbnails
+from mapstory.context_processors import remote_content_url
+from mapstory.utils import render_link
+import hashlib
+import urllib
 
 register = template.Library()
 
 @register.simple_tag
 def remote_content(path):
-    return '%s/%s' % (settings.REMOTE_CONTENT_URL, path)
+    return remote_content_url(path)
 
 
 @register.simple_tag
 def link(href, name, width=None, height=None, css_class=None):
-    return Link(href, name).render(width, height, css_class)
+    return render_link(href, name, width, height, css_class)
 
+
+def _gravatar_url(user, size):
+    params = {'s': str(size)}
+    if AVATAR_GRAVATAR_DEFAULT:
+        params['d'] = AVATAR_GRAVATAR_DEFAULT
+    return '%s://www.gravatar.com/avatar/%s/?%s' % (
+        'https' if AVATAR_GRAVATAR_SSL else 'http',
+        hashlib.md5(user.email.encode('utf-8')).hexdigest(),
+        urllib.urlencode(params))
+
+
+def _thumbnail_url(avatar, size):
+    name = avatar.avatar_name(size)
+    if thumbnails.exists(avatar.avatar.storage, name):
+        return avatar.avatar.storage.url(name)
+    return None
+
+
+def _avatar_urls(user, size):
+    '''(url, url for 2x screens or None), as avatar_tags.avatar_url'''
+    # avatar_set is expected to be prefetched, so unlike avatar_tags this
+    # does not query per user
+    avatars = user.avatar_set.all()
+    if avatars:
+        # the primary avatar, else the latest, see get_primary_avatar
+        avatar = max(avatars, key=lambda a: (a.primary, a.date_uploaded))
+        # the thumbnails are made by a job after the upload, until then the
+        # original is shown scaled
+        url = _thumbnail_url(avatar, size) or avatar.avatar.url
+        return url, _thumbnail_url(avatar, size * 2)
+    if AVATAR_GRAVATAR_BACKUP:
+        return _gravatar_url(user, size), _gravatar_url(user, size * 2)
+    return get_default_avatar_url(), None
+
+
+@register.simple_tag
+def prefetched_avatar(user, size=AVATAR_DEFAULT_SIZE):
+    url, double = _avatar_urls(user, size)
+    srcset = ' srcset="%s 2x"' % escape(double) if double else ''
+    return '<img src="%s"%s width="%s" height="%s" alt="%s" />' % (
+        escape(url), srcset, size, size, escape(unicode(user)))
@@ -1,5 +1,51 @@
+from mapstory import context_processors
+from mapstory import jobs
+from mapstory import playback
+from mapstory import tasks
+from mapstory.views import DiaryListView
+from mapstory.views import GetPageView
+from mapstory.views import story_frames
+from mapstory.models import DiaryEntry
+from mapstory.models import GetPage
+from mapstory.models import NewsItem
+from mapstory.models import SearchDocument
 from mapstory.models import Sponsor
 from mapstory.models import get_sponsors
+from mapstory.profiles import summary
+from mapstory.proxy import GeoServerProxy
+from mapstory.search import search
+from mapstory.seed import bulk_seed
+from mapstory.tilecache import TileCacheMiddleware
+from mapstory.tilecache import normalize
+from mapstory.utils import Link
+from mapstory.utils import LRUCache
+from geonode.maps.models import Map
+from geonode.maps.models import MapLayer
+from geonode.people.models import Profile
+from django.contrib.auth.models import AnonymousUser
+from django.db import connection
+from django.dispatch import receiver
+from django.http import Http404
+from django.test.client import RequestFactory
+from django.test.signals import setting_changed
+from django.test.utils import CaptureQueriesContext
+from django.test.utils import override_settings
+from django.utils import timezone
+from multiprocessing.pool import ThreadPool
+import datetime
+import json
+from BaseHTTPServer import BaseHTTPRequestHandler
+from BaseHTTPServer import HTTPServer
+from wsgiref.util import setup_testing_defaults
+import shutil
+import tempfile
+import threading
+
+
+@receiver(setting_changed)
+def _reset_template_globals(sender, **kwargs):
+    # computed once per process, see mapstory.context_processors
+    context_processors.reset()
 
 
 def make(model, **kwargs):
@@ -15,3 +61,354 @@ def test_sponsor_ordering():
     assert s.count() is 2, 'expected 2 sponsors'
     assert s[0].order is 0 and s[0].name == 'b'
     assert s[1].order is 1 and s[1].name == 'a'
+
+
+def test_textile_cache():
+    n = make(NewsItem, title='a', content='*bold*')
+    assert n.html_stamp, 'expected html to be rendered on save'
+    assert '<strong>bold</strong>' in n.html_cache
+    n.content = '_em_'
+    assert '<em>em</em>' in n.html(), 'expected stale html to be rebuilt'
+    assert NewsItem.objects.get(pk=n.pk).html_cache == n.html_cache
+
+
+@override_settings(JOBS_EAGER=True)
+def test_content_search():
+    n = make(NewsItem, title='Rivers', content='the *longest* rivers &amp; lakes')
+    make(NewsItem, title='Mountains', content='no water here')
+    assert SearchDocument.objects.get(object_id=n.pk).text.strip() == 'the longest rivers & lakes'
+    assert [d.title for d in search('rivers')] == ['Rivers']
+    n.delete()
+    assert search('rivers') == [], 'expected deleted content to be unindexed'
+
+
+def test_bulk_seed():
+    before = NewsItem.objects.count()
+    bulk_seed({'news': 25}, batch_size=10)
+    bulk_seed({'news': 25}, batch_size=10)
+    items = [(n.title, n.html_cache) for n in NewsItem.objects.order_by('pk')[before:]]
+    assert len(items) == 50
+    assert items[:25] == items[25:], 'expected the same seed to give the same data'
+    assert all(html for title, html in items), 'expected rendered textile'
+
+
+@override_settings(JOBS_EAGER=True)
+def test_profile_summary():
+    user = make(Profile, username='summary')
+    make(DiaryEntry, title='draft', content='x', author=user)
+    assert summary(user, user)['diary_entries'] == 0, 'expected drafts not to be counted'
+    entry = make(DiaryEntry, title='entry', content='x', author=user, publish=True)
+    s = summary(user, user)
+    assert s['diary_entries'] == 1, 'expected the summary to be invalidated on save'
+    assert [e['title'] for e in s['recent_diary_entries']] == ['entry']
+    entry.delete()
+    assert summary(user, user)['diary_entries'] == 0
+    private = make(Map, title='private', owner=user)
+    make(Map, title='public', abstract='public', owner=user)
+    assert summary(user, user)['maps'] == 2
+    visitor = AnonymousUser()
+    assert [m['title'] for m in summary(user, visitor)['recent_maps']] == ['public'], \
+        'expected visitors to only see public maps'
+    private.owner = make(Profile, username='other')
+    private.save()
+    assert summary(user, user)['maps'] == 1, 'expected the previous owner to be invalidated'
+
+
+def _getpage(name):
+    view = GetPageView(kwargs={'slug': name})
+    return view.get_object()
+
+
+def test_getpage_cache():
+    page = make(GetPage, name='cached', title='Cached')
+    assert _getpage('cached').title == 'Cached'
+    page.name = 'renamed'
+    page.save()
+    assert _getpage('renamed').pk == page.pk
+    try:
+        _getpage('cached')
+        assert False, 'expected the previous name to be invalidated'
+    except Http404:
+        pass
+    page.delete()
+    try:
+        _getpage('renamed')
+        assert False, 'expected deleted pages to be invalidated'
+    except Http404:
+        pass
+
+
+def _diary_page(author, **params):
+    request = RequestFactory().get('/diary/', params)
+    request.user = AnonymousUser()
+    view = DiaryListView(request=request, args=(), kwargs={})
+    entries = view.paginate_queryset(DiaryEntry.objects.filter(author=author), 2)[2]
+    return [e.title for e in entries], view.previous_cursor, view.next_cursor
+
+
+def test_diary_cursor():
+    author = make(Profile, username='pager')
+    for i in range(5):
+        make(DiaryEntry, title=str(i), content='x', author=author, publish=True,
+             date=datetime.datetime(2014, 1, i + 1))
+    titles, previous, next = _diary_page(author)
+    assert titles == ['4', '3'] and previous is None
+    titles, previous, next = _diary_page(author, after=next)
+    assert titles == ['2', '1']
+    titles, previous, next = _diary_page(author, after=next)
+    assert titles == ['0'] and next is None
+    titles, previous, next = _diary_page(author, before=previous)
+    assert titles == ['2', '1'], 'expected to page back to the newer entries'
+    titles, previous, next = _diary_page(author, before=previous)
+    assert titles == ['4', '3'] and previous is None
+
+
+def _diary_etag(user):
+    request = RequestFactory().get('/diary/')
+    request.user = user
+    return DiaryListView(request=request, args=(), kwargs={})._etag(request)
+
+
+def test_diary_etag():
+    author = make(Profile, username='diarist')
+    make(DiaryEntry, title='etag', content='x', author=author, publish=True)
+    etag = _diary_etag(AnonymousUser())
+    with CaptureQueriesContext(connection) as queries:
+        assert _diary_etag(AnonymousUser()) == etag
+    assert not queries.captured_queries, 'expected the validator to be cached'
+    author.save(update_fields=['last_login'])
+    assert _diary_etag(AnonymousUser()) == etag, 'expected logging in to keep the etag'
+    author.first_name = 'Renamed'
+    author.save()
+    assert _diary_etag(AnonymousUser()) != etag, 'expected author changes to change the etag'
+
+
+@override_settings(JOBS_EAGER=False)
+def test_jobs():
+    jobs.run_pending()
+    n = make(NewsItem, title='Queued', content='waiting for the worker')
+    assert not search('worker'), 'expected indexing to wait for a worker'
+    failing = jobs.enqueue('mapstory.tasks.index_content', 'mapstory.nosuchmodel', [1])
+    assert jobs.run_pending() == 2
+    assert [d.object_id for d in search('worker')] == [n.pk]
+    assert jobs.Job.objects.get(pk=failing.pk).status == jobs.Job.FAILED
+    day = datetime.timedelta(days=1)
+    jobs.Job.objects.filter(pk=failing.pk).update(finished=timezone.now() - 30 * day)
+    stale = make(jobs.Job, name='mapstory.tasks.index_content', status=jobs.Job.RUNNING,
+                 started=timezone.now() - day)
+    assert jobs.prune(days=7) == 1, 'expected old finished jobs to be deleted'
+    assert jobs.requeue_stale(timeout=60) == 1
+    assert jobs.Job.objects.get(pk=stale.pk).status == jobs.Job.QUEUED
+
+
+@override_settings(JOBS_EAGER=True)
+def test_rerender_textile():
+    n = make(NewsItem, title='Rerendered', content='old words')
+    NewsItem.objects.filter(pk=n.pk).update(content='*fresh* words')
+    tasks.rerender_textile('mapstory.newsitem', [n.pk])
+    rendered = NewsItem.objects.get(pk=n.pk)
+    assert '<strong>fresh</strong>' in rendered.html_cache
+    assert rendered.modified > n.modified, 'expected the modification time to change'
+    assert [d.object_id for d in search('fresh')] == [n.pk], 'expected the content to be reindexed'
+
+
+def test_link_classifier():
+    assert Link('http://www.youtube.com/watch?v=abc').get_youtube_video() == 'abc'
+    assert Link('https://youtu.be/abc').get_youtube_video() == 'abc'
+    assert Link('https://twitter.com/MapStory').get_twitter_link() == 'MapStory'
+    assert Link('https://twitter.com/MapStory').get_facebook_link() is None
+    assert Link('http://mapstory.org/a.PNG').is_image()
+
+
+def test_lru_cache():
+    c = LRUCache(10)
+    for i in range(10):
+        c.set(i, i)
+    c.get(0)
+    c.set(10, 10)
+    assert len(c) == 9
+    assert c.get(0) == 0, 'expected recently used key to be kept'
+    assert c.get(1) is None, 'expected least recently used key to be evicted'
+
+
+class StubGeoServer(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    ports = set()
+
+    def do_GET(self):
+        StubGeoServer.ports.add(self.client_address[1])
+        body = 'path=%s host=%s' % (self.path, self.headers['host'])
+        self.send_response(200)
+        self.send_header('Content-Type', 'text/plain')
+        self.send_header('Set-Cookie', 'JSESSIONID=a; Path=/geoserver')
+        self.send_header('Set-Cookie', 'GS_FLOW_CONTROL=b; Path=/geoserver')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+def stub_server(handler):
+    server = HTTPServer(('127.0.0.1', 0), handler)
+    thread = threading.Thread(target=server.serve_forever)
+    thread.daemon = True
+    thread.start()
+    return server
+
+
+def wsgi_get(app, path, query='', headers=None):
+    environ = {'PATH_INFO': path, 'QUERY_STRING': query}
+    setup_testing_defaults(environ)
+    status = []
+
+    def start_response(s, response_headers):
+        status.append(s)
+        if headers is not None:
+            headers.extend(response_headers)
+
+    body = app(environ, start_response)
+    try:
+        return status[0], ''.join(body)
+    finally:
+        body.close()
+
+
+def test_proxy_keep_alive():
+    server = stub_server(StubGeoServer)
+    address = 'http://127.0.0.1:%s/geoserver/' % server.server_port
+    proxy = GeoServerProxy(address, timeout=5, chunk_size=4)
+    try:
+        for i in range(3):
+            status, body = wsgi_get(proxy, '/wms', 'request=GetMap')
+            assert status == '200 OK'
+            assert body == 'path=/geoserver/wms?request=GetMap host=127.0.0.1:%s' % server.server_port
+        assert len(StubGeoServer.ports) == 1, 'expected one upstream connection'
+        assert proxy.metrics.stats()['reused_connections'] == 2
+    finally:
+        # the single threaded stub serves the kept alive connection until
+        # it is closed
+        proxy.pool.clear()
+        server.shutdown()
+
+
+def test_proxy_set_cookie():
+    server = stub_server(StubGeoServer)
+    proxy = GeoServerProxy('http://127.0.0.1:%s/geoserver/' % server.server_port, timeout=5)
+    try:
+        headers = []
+        wsgi_get(proxy, '/wms', 'request=GetMap', headers)
+        assert [v for k, v in headers if k.lower() == 'set-cookie'] == [
+            'JSESSIONID=a; Path=/geoserver', 'GS_FLOW_CONTROL=b; Path=/geoserver'], \
+            'expected every cookie to be forwarded separately'
+    finally:
+        proxy.pool.clear()
+        server.shutdown()
+
+
+def test_tile_cache_key():
+    a = normalize('REQUEST=GetMap&LAYERS=geonode:b,geonode:a&TIME=2001&_=1')
+    b = normalize('layers=geonode:b,geonode:a&time=2001&request=getmap')
+    assert a == b, 'expected parameter order and case not to matter'
+    assert a[1] == ['geonode:a', 'geonode:b']
+    assert normalize('REQUEST=GetMap&LAYERS=geonode:a&TIME=2002') != a
+    assert normalize('REQUEST=GetCapabilities') is None
+
+
+def test_tile_cache_credentials():
+    calls = []
+
+    def app(environ, start_response):
+        calls.append(environ.get('HTTP_COOKIE'))
+        start_response('200 OK', [('Content-Type', 'image/png')])
+        return ['png']
+
+    location = tempfile.mkdtemp()
+    try:
+        cached = TileCacheMiddleware(app, location, 1024 ** 2)
+
+        def get(**headers):
+            environ = dict(REQUEST_METHOD='GET', PATH_INFO='/geoserver/wms',
+                           QUERY_STRING='request=GetMap&layers=geonode:a', **headers)
+            body = cached(environ, lambda status, headers: None)
+            data = ''.join(body)
+            if hasattr(body, 'close'):
+                body.close()
+            return data
+
+        get(HTTP_COOKIE='sessionid=private')
+        get(HTTP_COOKIE='csrftoken=x')
+        get(HTTP_COOKIE='csrftoken=x')
+        get(HTTP_AUTHORIZATION='Basic eDp5')
+        get(HTTP_COOKIE='JSESSIONID=geoserver; csrftoken=x')
+        assert calls == ['sessionid=private', 'csrftoken=x', None,
+                         'JSESSIONID=geoserver; csrftoken=x'], \
+            'expected only anonymous requests to be cached'
+    finally:
+        shutil.rmtree(location)
+
+
+def test_story_frame_times():
+    assert playback.request_times({'start': '1850', 'end': '1851-01-01', 'frames': '3'}, 10) == [
+        '1850-01-01T00:00:00Z', '1850-07-02T12:00:00Z', '1851-01-01T00:00:00Z']
+    assert playback.request_times(
+        {'start': '2001-01-01T01:00:00+01:00', 'end': '2001-01-01', 'frames': '1'}, 10) == [
+        '2001-01-01T00:00:00Z']
+    for bad in ({'start': '2001'}, {'start': '2002', 'end': '2001'},
+                {'start': '2001', 'end': '2002'},
+                {'start': '2001', 'end': '2002', 'frames': '11'},
+                {'start': 'yesterday', 'end': '2002'}):
+        try:
+            playback.request_times(bad, 10)
+        except ValueError:
+            continue
+        raise AssertionError('expected %s to be rejected' % bad)
+    params = playback.getmap_params({'bbox': '0,0,1,1', 'width': '4096', 'height': '2048'})
+    assert (params['width'], params['height']) == ('1024', '512'), 'expected frames to be scaled down'
+
+
+def test_story_frames():
+    requests = []
+
+    def geoserver(environ, start_response):
+        requests.append((environ['QUERY_STRING'], environ.get('HTTP_COOKIE')))
+        start_response('200 OK', [('Content-Type', 'image/png')])
+        return ['png']
+
+    owner = make(Profile, username='storyteller')
+    map_obj = make(Map, title='story', owner=owner)
+    make(MapLayer, map=map_obj, name='geonode:private', local=True)
+    make(MapLayer, map=map_obj, name='remote', local=False)
+    saved = playback._app, playback._pool
+    playback._app, playback._pool = geoserver, ThreadPool(2)
+    try:
+        request = RequestFactory().get('/maps/%s/frames' % map_obj.pk, dict(
+            start='2001', end='2002', frames='2', bbox='0,0,1,1'), HTTP_COOKIE='sessionid=s')
+        request.user = owner
+        lines = [json.loads(l) for l in story_frames(request, str(map_obj.pk)).streaming_content]
+        assert [(l['layer'], l['time'], l['data']) for l in lines] == [
+            ('geonode:private', '2001-01-01T00:00:00Z', 'cG5n'),
+            ('geonode:private', '2002-01-01T00:00:00Z', 'cG5n')]
+        assert all(cookie == 'sessionid=s' for query, cookie in requests), \
+            'expected non public layers to be requested as the viewer'
+        del requests[:]
+        list(playback.frames(map_obj.layer_set.filter(local=True), ['2001'], {}, 'sessionid=s',
+                             public=set(['geonode:private'])))
+        assert requests[0][1] is None, 'expected public layers to be requested anonymously'
+        request = RequestFactory().get('/maps/%s/frames' % map_obj.pk, dict(start='2001'))
+        request.user = owner
+        assert story_frames(request, str(map_obj.pk)).status_code == 400
+        request = RequestFactory().get('/maps/%s/frames' % map_obj.pk, dict(
+            start='2001', end='2002', frames='20', bbox='0,0,1,1'))
+        request.user = AnonymousUser()
+        assert story_frames(request, str(map_obj.pk)).status_code == 400, \
+            'expected anonymous users to get fewer frames'
+        with override_settings(STORY_PREFETCH_RATE=1):
+            request.GET = dict(start='2001', end='2002', frames='1', bbox='0,0,1,1')
+            request.META['REMOTE_ADDR'] = '192.0.2.1'
+            assert story_frames(request, str(map_obj.pk)).status_code == 200
+            assert story_frames(request, str(map_obj.pk)).status_code == 429
+    finally:
+        playback._pool.close()
+        playback._app, playback._pool = saved
@@ -0,0 +1,103 @@
+'''
+Resized variants of uploaded images for srcset.
+
+Variants are written next to the original, named after it and their size:
+sponsors/logo.1a2b3c4d.240.png and sponsors/logo.1a2b3c4d.240.webp for
+sponsors/logo.1a2b3c4d.gif. They are made by a job (see mapstory.tasks)
+when an upload is saved so the upload request does not wait for them, and
+pages only reference the variants that exist.
+'''
+from django.core.files.base import ContentFile
+from PIL import Image
+import os
+import StringIO
+import time
+
+
+# variant names carry the name of their original, which changes with every
+# upload, so a variant that exists once stays valid
+_existing = set()
+# variant name -> when to look again, variants larger than their original
+# never exist and the others appear once their job ran
+_missing = {}
+MISSING_TIMEOUT = 60
+_webp = None
+
+
+def webp_supported():
+    global _webp
+    if _webp is None:
+        try:
+            Image.new('RGB', (1, 1)).save(StringIO.StringIO(), 'WEBP')
+            _webp = True
+        except (IOError, KeyError):
+            _webp = False
+    return _webp
+
+
+def fallback_format(name):
+    '''(PIL format, extension) of the variants every browser can show'''
+    if os.path.splitext(name)[1].lower() in ('.jpg', '.jpeg'):
+        return 'JPEG', '.jpg'
+    return 'PNG', '.png'
+
+
+def variant_name(name, size, ext):
+    return '%s.%d%s' % (os.path.splitext(name)[0], size, ext)
+
+
+def make_variants(storage, name, sizes):
+    '''write the variants of the image name that fit in size x size boxes,
+    without enlarging it'''
+    with storage.open(name) as fp:
+        image = Image.open(fp)
+        image.load()
+    if image.mode not in ('RGB', 'RGBA', 'L'):
+        image = image.convert('RGBA')
+    formats = [fallback_format(name)]
+    if webp_supported():
+        formats.append(('WEBP', '.webp'))
+    written = []
+    for size in sorted(sizes):
+        if size > max(image.size):
+            break
+        thumb = image.copy()
+        thumb.thumbnail((size, size), Image.ANTIALIAS)
+        for format, ext in formats:
+            out = StringIO.StringIO()
+            thumb.convert('RGB' if format == 'JPEG' else thumb.mode).save(
+                out, format, quality=85)
+            variant = variant_name(name, size, ext)
+            if storage.exists(variant):
+                storage.delete(variant)
+            storage.save(variant, ContentFile(out.getvalue()))
+            written.append(variant)
+            _missing.pop(variant, None)
+    return written
+
+
+def exists(storage, variant):
+    '''whether the variant exists, asking the storage at most once per
+    MISSING_TIMEOUT'''
+    if variant in _existing:
+        return True
+    if _missing.get(variant, 0) > time.time():
+        return False
+    if not storage.exists(variant):
+        _missing[variant] = time.time() + MISSING_TIMEOUT
+        return False
+    _missing.pop(variant, None)
+    _existing.add(variant)
+    return True
+
+
+def srcset(storage, name, sizes, ext):
+    '''srcset of the existing variants, with densities relative to the
+    smallest size'''
+    base = float(min(sizes))
+    candidates = []
+    for size in sorted(sizes):
+        variant = variant_name(name, size, ext)
+        if exists(storage, variant):
+            candidates.append('%s %gx' % (storage.url(variant), size / base))
+    return ', '.join(candidates)
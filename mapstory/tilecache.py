@@ -0,0 +1,358 @@
+'''
+A size bounded, least recently used disk cache of WMS GetMap and WMTS GetTile
+responses, used as a filter in front of the GeoServer proxy:
+
+    [filter:tilecache]
+    use = call:mapstory.tilecache:make_filter
+
+    [pipeline:geoserver]
+    pipeline = tilecache gsproxy_app
+
+Responses are keyed on the normalized OGC parameters (including TIME, so every
+frame of a story is its own entry) and on a generation number of each
+requested layer. Invalidating a layer bumps its generation, which makes the
+old entries unreachable until they are evicted. Generations live on disk so
+any process sharing the cache location can invalidate.
+
+GeoServer applies GeoNode's layer permissions to the requesting user, so
+requests carrying credentials bypass the cache: their responses must not be
+served to anybody else. Any cookie GeoServer might authenticate with
+(GeoNode's session, JSESSIONID, ...) counts, only those known to be harmless
+do not.
+
+The filter is part of the development server (paster.ini) and of the story
+frame prefetch (mapstory.playback). In production nginx proxies /geoserver/
+to GeoServer directly, so other tile requests are not cached.
+'''
+from django.conf import settings
+import Cookie
+import hashlib
+import json
+import logging
+import os
+import struct
+import tempfile
+import threading
+import urllib
+import urlparse
+from collections import OrderedDict
+
+
+logger = logging.getLogger(__name__)
+
+CACHEABLE_REQUESTS = frozenset(('getmap', 'gettile'))
+# parameters that only defeat browser caches
+IGNORED_PARAMS = frozenset(('_',))
+# parameters whose values OGC services compare case insensitively
+CASE_INSENSITIVE = frozenset((
+    'service', 'request', 'format', 'srs', 'crs', 'transparent', 'exceptions',
+))
+STORED_HEADERS = frozenset(('content-type', 'content-disposition'))
+# cookies that do not identify a user, besides the CSRF and language cookies
+HARMLESS_COOKIES = frozenset(('csrftoken', 'django_language'))
+HARMLESS_COOKIE_PREFIXES = ('_ga', '_gid', '__utm')
+
+_HEADER = struct.Struct('!I')
+
+
+def _generations_dir(location):
+    return os.path.join(location, 'generations')
+
+
+def _generation_path(location, layer):
+    return os.path.join(_generations_dir(location), urllib.quote(layer, safe=''))
+
+
+def normalize(query_string):
+    '''(normalized query, [layer names]) or None if the request is not
+    cacheable'''
+    params = {}
+    for key, value in urlparse.parse_qsl(query_string, keep_blank_values=True):
+        key = key.lower()
+        if key in CASE_INSENSITIVE:
+            value = value.lower()
+        if key not in IGNORED_PARAMS:
+            params[key] = value
+    if params.get('request') not in CACHEABLE_REQUESTS:
+        return None
+    layers = params.get('layers') or params.get('layer')
+    if not layers:
+        return None
+    return urllib.urlencode(sorted(params.items())), sorted(set(layers.split(',')))
+
+
+def has_credentials(environ):
+    '''True if the response to the request may depend on who makes it'''
+    if environ.get('HTTP_AUTHORIZATION'):
+        return True
+    header = environ.get('HTTP_COOKIE')
+    if not header:
+        return False
+    cookies = Cookie.SimpleCookie()
+    try:
+        cookies.load(header)
+    except Cookie.CookieError:
+        # cannot tell, assume the worst
+        return True
+    harmless = HARMLESS_COOKIES | set((settings.CSRF_COOKIE_NAME, settings.LANGUAGE_COOKIE_NAME))
+    return any(name not in harmless and not name.startswith(HARMLESS_COOKIE_PREFIXES)
+               for name in cookies)
+
+
+class TileCache(object):
+
+    def __init__(self, location, max_size):
+        self.location = location
+        self.max_size = max_size
+        self.entries_dir = os.path.join(location, 'entries')
+        self.tmp_dir = os.path.join(location, 'tmp')
+        self.generations_dir = _generations_dir(location)
+        for d in (self.entries_dir, self.tmp_dir, self.generations_dir):
+            if not os.path.isdir(d):
+                os.makedirs(d)
+        self._lock = threading.Lock()
+        # key -> size, least recently used first
+        self._index = OrderedDict()
+        self._size = 0
+        self._load_index()
+
+    def _load_index(self):
+        found = []
+        for dirpath, dirnames, filenames in os.walk(self.entries_dir):
+            for name in filenames:
+                st = os.stat(os.path.join(dirpath, name))
+                found.append((st.st_mtime, name, st.st_size))
+        for mtime, key, size in sorted(found):
+            self._index[key] = size
+            self._size += size
+
+    def generation(self, layer):
+        # the generation is the size of the layer's file so bumping it is a
+        # single atomic append, see invalidate_layer
+        try:
+            return os.stat(_generation_path(self.location, layer)).st_size
+        except OSError:
+            return 0
+
+    def invalidate_layer(self, layer):
+        invalidate_layer(layer, self.location)
+
+    def key(self, path, query, layers):
+        generations = ','.join('%s=%s' % (l, self.generation(l)) for l in layers)
+        return hashlib.sha1('%s?%s#%s' % (path, query, generations)).hexdigest()
+
+    def _path(self, key):
+        return os.path.join(self.entries_dir, key[:2], key)
+
+    def get(self, key):
+        '''(status, headers, file) or None'''
+        with self._lock:
+            if key not in self._index:
+                return None
+            self._index[key] = self._index.pop(key)
+        path = self._path(key)
+        try:
+            fp = open(path, 'rb')
+        except IOError:
+            # evicted by another process sharing the location
+            self._forget(key)
+            return None
+        try:
+            os.utime(path, None)
+            length, = _HEADER.unpack(fp.read(_HEADER.size))
+            status, headers = json.loads(fp.read(length))
+        except Exception:
+            fp.close()
+            logger.warning('dropping unreadable tile cache entry %s', key, exc_info=True)
+            self._remove(key)
+            return None
+        return status, [tuple(h) for h in headers], fp
+
+    def writer(self, key, status, headers):
+        return _EntryWriter(self, key, status, headers)
+
+    def _store(self, key, tmp_path):
+        path = self._path(key)
+        if not os.path.isdir(os.path.dirname(path)):
+            try:
+                os.makedirs(os.path.dirname(path))
+            except OSError:
+                pass
+        os.rename(tmp_path, path)
+        size = os.path.getsize(path)
+        with self._lock:
+            self._size += size - self._index.pop(key, 0)
+            self._index[key] = size
+            evict = []
+            while self._size > self.max_size and len(self._index) > 1:
+                old, old_size = self._index.popitem(last=False)
+                self._size -= old_size
+                evict.append(old)
+        for old in evict:
+            self._unlink(old)
+
+    def _forget(self, key):
+        with self._lock:
+            self._size -= self._index.pop(key, 0)
+
+    def _unlink(self, key):
+        try:
+            os.unlink(self._path(key))
+        except OSError:
+            pass
+
+    def _remove(self, key):
+        self._forget(key)
+        self._unlink(key)
+
+    def stats(self):
+        with self._lock:
+            return dict(entries=len(self._index), size=self._size,
+                        max_size=self.max_size)
+
+
+class _EntryWriter(object):
+    '''writes a response to a temporary file and moves it into the cache
+    once it is complete'''
+
+    def __init__(self, cache, key, status, headers):
+        self.cache = cache
+        self.key = key
+        fd, self.tmp_path = tempfile.mkstemp(dir=cache.tmp_dir)
+        self.fp = os.fdopen(fd, 'wb')
+        header = json.dumps([status, [h for h in headers
+                                      if h[0].lower() in STORED_HEADERS]])
+        self.fp.write(_HEADER.pack(len(header)))
+        self.fp.write(header)
+
+    def write(self, data):
+        self.fp.write(data)
+
+    def commit(self):
+        self.fp.close()
+        self.cache._store(self.key, self.tmp_path)
+
+    def abort(self):
+        self.fp.close()
+        try:
+            os.unlink(self.tmp_path)
+        except OSError:
+            pass
+
+
+def _file_chunks(fp, chunk_size=64 * 1024):
+    try:
+        while True:
+            chunk = fp.read(chunk_size)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        fp.close()
+
+
+class _TeeBody(object):
+    '''passes the wrapped body on while writing it to the cache'''
+
+    def __init__(self, body, writer):
+        self.body = body
+        self.writer = writer
+        self.done = False
+
+    def __iter__(self):
+        for chunk in self.body:
+            self.writer.write(chunk)
+            yield chunk
+        self.done = True
+
+    def close(self):
+        if hasattr(self.body, 'close'):
+            self.body.close()
+        if self.done:
+            self.writer.commit()
+        else:
+            self.writer.abort()
+
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+
+def _default_location():
+    return settings.TILE_CACHE['LOCATION']
+
+
+def get_cache(location=None, max_size=None):
+    '''the TileCache for location, by default from the TILE_CACHE setting'''
+    options = settings.TILE_CACHE
+    location = location or options['LOCATION']
+    with _caches_lock:
+        if location not in _caches:
+            _caches[location] = TileCache(
+                location, max_size or options.get('MAX_SIZE', 1024 ** 3))
+        return _caches[location]
+
+
+def invalidate_layer(layer, location=None):
+    '''make all cached responses including layer unreachable'''
+    location = location or _default_location()
+    if not os.path.isdir(_generations_dir(location)):
+        os.makedirs(_generations_dir(location))
+    with open(_generation_path(location, layer), 'ab') as fp:
+        fp.write('.')
+
+
+class TileCacheMiddleware(object):
+
+    def __init__(self, app, location=None, max_size=None):
+        self.app = app
+        self.location = location
+        self.max_size = max_size
+        self._cache = None
+
+    @property
+    def cache(self):
+        # settings are read on first use, paste may build the filter before
+        # django is configured
+        if self._cache is None:
+            self._cache = get_cache(self.location, self.max_size)
+        return self._cache
+
+    def __call__(self, environ, start_response):
+        normalized = None
+        if environ['REQUEST_METHOD'] == 'GET' and not has_credentials(environ):
+            normalized = normalize(environ.get('QUERY_STRING', ''))
+        if normalized is None:
+            return self.app(environ, start_response)
+
+        query, layers = normalized
+        key = self.cache.key(environ.get('PATH_INFO', ''), query, layers)
+        entry = self.cache.get(key)
+        if entry is not None:
+            status, headers, fp = entry
+            start_response(status, headers + [('X-Tile-Cache', 'hit')])
+            return _file_chunks(fp)
+
+        captured = {}
+
+        def capture(status, headers, exc_info=None):
+            captured['status'], captured['headers'] = status, headers
+            headers = headers + [('X-Tile-Cache', 'miss')]
+            if exc_info:
+                return start_response(status, headers, exc_info)
+            return start_response(status, headers)
+
+        body = self.app(environ, capture)
+        content_type = dict((k.lower(), v) for k, v in captured.get('headers', ()))
+        content_type = content_type.get('content-type', '')
+        # GeoServer reports service exceptions with a 200 and an xml body
+        if not (captured.get('status', '').startswith('200') and
+                content_type.startswith('image/')):
+            return body
+        return _TeeBody(body, self.cache.writer(key, captured['status'], captured['headers']))
+
+
+def make_filter(global_conf, location=None, max_size=None):
+    '''paste filter factory'''
+    max_size = int(max_size) if max_size else None
+    return lambda app: TileCacheMiddleware(app, location, max_size)
@@ -14,16 +14,18 @@ from mapstory.views import GetPageView
 from mapstory.views import ProfileDetail
 from mapstory.views import SearchView
 from mapstory.views import LeaderListView
+from mapstory.views import map_view
+from mapstory.views import new_map
+from mapstory.views import search_content
+from mapstory.views import search_facets_json
+from mapstory.views import story_frames
 
 
 urlpatterns = patterns('',
     url(r'^$', IndexView.as_view()),
-    url(r'^maps/new2$',
-        'geonode.maps.views.new_map', {'template': 'maps/mapstory_map_view.html'},
-        name='map-new2'),
-    url(r'^maps/(?P<mapid>\d+)/view2$',
-        'geonode.maps.views.map_view', {'template': 'maps/mapstory_map_view.html'},
-        name='map-view2'),
+    url(r'^maps/new2$', new_map, name='map-new2'),
+    url(r'^maps/(?P<mapid>\d+)/view2$', map_view, name='map-view2'),
+    url(r'^maps/(?P<mapid>\d+)/frames$', story_frames, name='map-frames'),
     url(r"^people/profile/(?P<slug>[^/]*)/$", ProfileDetail.as_view(), name="profile_detail"),
     url(r'^tours/editor_tour$', TemplateView.as_view(template_name='maps/editor_tour.html'), name='editor_tour'),
     url(r'^diary$', DiaryListView.as_view(), name='diary'),
@@ -32,6 +34,8 @@ urlpatterns = patterns('',
     url(r'^diary/write/(?P<pk>\d+)$', login_required(DiaryUpdateView.as_view()), name='diary-update'),
     url(r'^get(?P<slug>\w+)$', GetPageView.as_view(), name='getpage'),
     url(r'^searchn/$', SearchView.as_view(), name='search'),
+    url(r'^searchn/facets$', search_facets_json, name='search-facets'),
+    url(r'^searchn/content$', search_content, name='search-content'),
     url(r'^storylayerpage$', TemplateView.as_view(template_name='mapstory/storylayerpage.html'), name='storylayerpage'),
     url(r'^mapstorypage$', TemplateView.as_view(template_name='mapstory/mapstorypage.html'), name='mapstorypage'),
     url(r'^about/leadership$', LeaderListView.as_view(template_name='mapstory/leaders.html'), name='about-leaders'),
@@ -1,37 +1,97 @@
+import itertools
 import os
 import re
+import threading
 from django.contrib.staticfiles.templatetags import staticfiles
+from mapstory.instrumentation import timed
+
+
+_LINK_RE = re.compile(
+    'https?://(?:w{3}\.)?(?:'
+    'youtube.com/watch\?v=(?P<youtube_watch>\S+)|'
+    'youtu.be/(?P<youtube_short>\S+)|'
+    'youtube.com/embed/(?P<youtube_embed>\S+)|'
+    'twitter.com/(?P<twitter>\S+)|'
+    'facebook.com/(?P<facebook>\S+)'
+    ')'
+)
+
+_IMAGE_EXTENSIONS = frozenset(('gif', 'jpg', 'jpeg', 'png'))
+
+# resolved on first use rather than at import so a missing static file
+# cannot break loading the template library
+_icons = {}
+
+
+def _icon(name):
+    try:
+        return _icons[name]
+    except KeyError:
+        return _icons.setdefault(name, staticfiles.static('img/%s.png' % name))
+
+
+class LRUCache(object):
+    '''A small thread-safe mapping holding at most size entries. When full,
+    the least recently used tenth is evicted in one go, which keeps lookups
+    lock-free.'''
+
+    def __init__(self, size):
+        self.size = size
+        self._data = {}
+        self._ticks = itertools.count()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        entry = self._data.get(key)
+        if entry is None:
+            return default
+        entry[1] = next(self._ticks)
+        return entry[0]
+
+    def set(self, key, value):
+        with self._lock:
+            self._data[key] = [value, next(self._ticks)]
+            if len(self._data) > self.size:
+                by_use = sorted(self._data.items(), key=lambda item: item[1][1])
+                for key, _ in by_use[:len(by_use) - self.size * 9 // 10]:
+                    del self._data[key]
+
+    def clear(self):
+        with self._lock:
+            self._data.clear()
+
+    def __len__(self):
+        return len(self._data)
+
 
 class Link(object):
 
     def __init__(self, href, name=None):
         self.href = href
         self.name = name
+        self._match = _LINK_RE.match(href)
 
     def is_image(self):
         ext = os.path.splitext(self.href)[1][1:].lower()
-        return ext in ('gif','jpg','jpeg','png')
+        return ext in _IMAGE_EXTENSIONS
 
-    def _get_link(self, *paths):
-        prefix = 'https?://(?:w{3}\.)?'
-        for p in paths:
-            match = re.match(prefix + p, self.href)
-            if match:
-                return match.group(1)
+    def _get_link(self, *groups):
+        if self._match:
+            for g in groups:
+                value = self._match.group(g)
+                if value:
+                    return value
 
     def get_youtube_video(self):
-        return self._get_link(
-            'youtube.com/watch\?v=(\S+)',
-            'youtu.be/(\S+)',
-            'youtube.com/embed/(\S+)',
-        )
+        return self._get_link('youtube_watch', 'youtube_short', 'youtube_embed')
 
     def get_twitter_link(self):
-        return self._get_link('twitter.com/(\S+)')
+        return self._get_link('twitter')
 
     def get_facebook_link(self):
-        return self._get_link('facebook.com/(\S+)')
+        return self._get_link('facebook')
 
+    @timed('link')
     def render(self, width=None, height=None, css_class=None):
         '''width and height are just hints - ignored for images'''
 
@@ -49,13 +109,22 @@ class Link(object):
                     ' src="http://www.youtube.com/embed/%(video)s">'
                     '</iframe>') % ctx
 
-        known_links = [
-            (self.get_twitter_link, staticfiles.static('img/twitter.png')),
-            (self.get_facebook_link, staticfiles.static('img/facebook.png')),
-        ]
-        for fun, icon in known_links:
-            if fun():
-                ctx['link_content'] = '<img src="%s" border=0>' % icon
+        for kind in ('twitter', 'facebook'):
+            if self._get_link(kind):
+                ctx['link_content'] = '<img src="%s" border=0>' % _icon(kind)
                 break
 
-        return '<a target="_" href="%(href)s">%(link_content)s</a>' % ctx
\ No newline at end of file
+        return '<a target="_" href="%(href)s">%(link_content)s</a>' % ctx
+
+
+_rendered_links = LRUCache(1024)
+
+
+def render_link(href, name=None, width=None, height=None, css_class=None):
+    '''Link(href, name).render(...) memoized on all of its arguments'''
+    key = (href, name, width, height, css_class)
+    html = _rendered_links.get(key)
+    if html is None:
+        html = Link(href, name).render(width, height, css_class)
+        _rendered_links.set(key, html)
+    return html
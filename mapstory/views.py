@@ -1,7 +1,20 @@
 from django.core.exceptions import PermissionDenied
 from django.core.urlresolvers import reverse
+from django.db.models import Count
+from django.db.models import Max
+from django.db.models import Q
+from django.conf import settings
+from django.http import Http404
+from django.http import HttpResponse
+from django.http import HttpResponseBadRequest
+from django.http import StreamingHttpResponse
 from django.shortcuts import render_to_response
 from django.template import RequestContext
+from django.template.loader import render_to_string
+from django.utils import timezone
+from django.utils import translation
+from django.utils.cache import patch_cache_control
+from django.views.decorators.http import condition
 from django.views.generic import TemplateView
 from django.views.generic.edit import ModelFormMixin
 from django.views.generic.edit import CreateView
@@ -11,37 +24,194 @@ from django.views.generic.list import ListView
 
 from geonode.people.models import Profile
 
+from mapstory import cache
+from mapstory import mapconfig
+from mapstory import playback
+from mapstory import profiles
+from mapstory import search
 from mapstory.models import get_sponsors
 from mapstory.models import GetPage
+from mapstory.models import GetPageContent
 from mapstory.models import NewsItem
 from mapstory.models import DiaryEntry
 from mapstory.models import Leader
 
 from geonode.base.models import Region
+from geonode.base.models import TopicCategory
+from geonode.maps.views import _PERMISSION_MSG_VIEW
+from geonode.maps.views import _resolve_map
+from geonode.maps.views import new_map as geonode_new_map
 
 import datetime
-
-class IndexView(TemplateView):
+import hashlib
+import json
+
+def _rows_validator(queryset):
+    '''(count, latest modification) of the rows of queryset'''
+    rows = queryset.order_by().aggregate(count=Count('pk'), modified=Max('modified'))
+    return rows['count'], rows['modified']
+
+
+class ConditionalMixin(object):
+    '''Answers conditional GETs with a 304 before anything is rendered when
+    the validator of the rows the page is built from did not change. The
+    pages include the user's menu and a CSRF token, so the ETag covers
+    those as well.
+
+    Validators named by get_validator_name are kept in the cache group
+    validator_group, whose version is part of the ETag, so changes the
+    validator does not see (the name or avatar of an author) are covered
+    and unchanged pages are answered without queries.'''
+
+    # invalidated with the rows the page is built from, see mapstory.models
+    validator_group = None
+
+    def get_validator(self):
+        '''a value that changes when the page does, None to always render'''
+        return None
+
+    def get_validator_name(self):
+        '''the name of the validator in validator_group'''
+        return None
+
+    def _validator(self):
+        name = self.get_validator_name()
+        if self.validator_group is None or name is None:
+            return self.get_validator()
+        # wrapped as get_or_build takes a tuple for (value, timeout) and
+        # None for a miss
+        validator, = cache.get_or_build('validator:%s' % name, lambda: [self.get_validator()],
+                                        group=self.validator_group)
+        if validator is None:
+            return None
+        return cache.group_version(self.validator_group), validator
+
+    def _etag(self, request, *args, **kwargs):
+        validator = self._validator()
+        if validator is None:
+            return None
+        return hashlib.sha1(repr((
+            validator,
+            request.user.pk,
+            request.COOKIES.get(settings.CSRF_COOKIE_NAME),
+            translation.get_language(),
+        ))).hexdigest()
+
+    def dispatch(self, request, *args, **kwargs):
+        view = super(ConditionalMixin, self).dispatch
+        return condition(etag_func=self._etag)(view)(request, *args, **kwargs)
+
+
+def _index_sponsors():
+    return list(get_sponsors())
+
+
+def _index_news():
+    now = datetime.datetime.now()
+    news_items = list(NewsItem.objects.filter(date__lte=now)[:3])
+    # expire when the next scheduled item becomes visible
+    timeout = cache.TIMEOUT
+    upcoming = NewsItem.objects.filter(date__gt=now).order_by('date')
+    upcoming = upcoming.values_list('date', flat=True)[:1]
+    if upcoming:
+        timeout = min(timeout, int((upcoming[0] - now).total_seconds()) + 1)
+    return news_items, timeout
+
+
+class IndexView(ConditionalMixin, TemplateView):
     template_name = 'index.html'
 
+    def _content(self):
+        return (cache.get_or_build('index:sponsors', _index_sponsors),
+                cache.get_or_build('index:news', _index_news))
+
+    def get_validator(self):
+        # the cached rows are what the page shows
+        sponsors, news_items = self._content()
+        return [(i.pk, i.modified) for i in sponsors + news_items]
+
     def get_context_data(self, **kwargs):
         ctx = super(IndexView, self).get_context_data(**kwargs)
-        ctx['sponsors'] = get_sponsors()
-        news_items = NewsItem.objects.filter(date__lte=datetime.datetime.now())
-        ctx['news_items'] = news_items[:3]
+        ctx['sponsors'], ctx['news_items'] = self._content()
         return ctx
 
 
-class DiaryListView(ListView):
+_CURSOR_DATE_FORMAT = '%Y%m%d%H%M%S%f'
+
+
+def _diary_cursor(entry):
+    # cursors are in UTC
+    date = entry.date
+    if timezone.is_aware(date):
+        date = timezone.make_naive(date, timezone.utc)
+    return '%s_%s' % (date.strftime(_CURSOR_DATE_FORMAT), entry.pk)
+
+
+def _parse_diary_cursor(cursor):
+    try:
+        date, pk = cursor.split('_')
+        date, pk = datetime.datetime.strptime(date, _CURSOR_DATE_FORMAT), int(pk)
+    except ValueError:
+        raise Http404('Invalid cursor')
+    if settings.USE_TZ:
+        date = timezone.make_aware(date, timezone.utc)
+    return date, pk
+
+
+class DiaryListView(ConditionalMixin, ListView):
     template_name = 'mapstory/diary.html'
     context_object_name = 'entries'
     paginate_by = 10
+    # page through (date, pk) with an 'after' (older) or 'before' (newer)
+    # cursor instead of OFFSET/COUNT
+    keyset = True
+    validator_group = 'diary'
+
+    def get_validator_name(self):
+        return 'diary:%s' % self.request.user.pk
+
+    def get_validator(self):
+        visible = Q(publish=True)
+        if self.request.user.is_authenticated():
+            # the user's drafts are listed too
+            visible |= Q(author=self.request.user)
+        return _rows_validator(DiaryEntry.objects.filter(visible))
 
     def get_queryset(self):
-        return DiaryEntry.objects.filter(publish=True)
+        return DiaryEntry.objects.filter(publish=True).select_related(
+            'author').prefetch_related('author__avatar_set')
+
+    def paginate_queryset(self, queryset, page_size):
+        if not self.keyset:
+            return super(DiaryListView, self).paginate_queryset(queryset, page_size)
+        before = self.request.GET.get('before')
+        if before:
+            date, pk = _parse_diary_cursor(before)
+            newer = queryset.filter(Q(date__gt=date) | Q(date=date, pk__gt=pk))
+            entries = list(newer.order_by('date', 'id')[:page_size + 1])
+            has_previous = len(entries) > page_size
+            entries = entries[:page_size][::-1]
+            self.previous_cursor = _diary_cursor(entries[0]) if has_previous else None
+            # the entry the cursor was taken from is older
+            self.next_cursor = _diary_cursor(entries[-1]) if entries else None
+            return None, None, entries, True
+        cursor = self.request.GET.get('after')
+        if cursor:
+            date, pk = _parse_diary_cursor(cursor)
+            queryset = queryset.filter(Q(date__lt=date) | Q(date=date, pk__lt=pk))
+        entries = list(queryset.order_by('-date', '-id')[:page_size + 1])
+        has_next = len(entries) > page_size
+        entries = entries[:page_size]
+        self.next_cursor = _diary_cursor(entries[-1]) if has_next else None
+        self.previous_cursor = _diary_cursor(entries[0]) if cursor and entries else None
+        return None, None, entries, has_next or bool(cursor)
 
     def get_context_data(self, **kwargs):
         ctx = super(DiaryListView, self).get_context_data(**kwargs)
+        if self.keyset:
+            ctx['cursor'] = self.request.GET.get('after') or self.request.GET.get('before')
+            ctx['next_cursor'] = self.next_cursor
+            ctx['previous_cursor'] = self.previous_cursor
         user = self.request.user
         if user.is_authenticated():
             ctx['drafts'] = DiaryEntry.objects.filter(author=user, publish=False)
@@ -63,11 +233,20 @@ class DiaryPermissionMixin(object):
         return obj
 
 
-class DiaryDetailView(DiaryPermissionMixin, DetailView):
+class DiaryDetailView(ConditionalMixin, DiaryPermissionMixin, DetailView):
     template_name = 'mapstory/diary_detail.html'
     model = DiaryEntry
     need_publish = True
     context_object_name = 'entry'
+    validator_group = 'diary'
+
+    def get_validator_name(self):
+        return 'diary:entry:%s' % self.kwargs['pk']
+
+    def get_validator(self):
+        # entries that are missing or not published are left to get_object
+        return list(DiaryEntry.objects.filter(pk=self.kwargs['pk'], publish=True)
+                    .values_list('modified', flat=True)) or None
 
 
 class DiaryEditMixin(object):
@@ -92,20 +271,81 @@ class DiaryUpdateView(DiaryEditMixin, DiaryPermissionMixin, UpdateView):
     pass
 
 
-class GetPageView(DetailView):
+class GetPageView(ConditionalMixin, DetailView):
     template_name = 'mapstory/getpage.html'
     model = GetPage
     slug_field = 'name'
+    validator_group = 'getpages'
+
+    def get_validator_name(self):
+        return 'getpage:%s' % self.kwargs.get(self.slug_url_kwarg)
+
+    def get_validator(self):
+        name = self.kwargs.get(self.slug_url_kwarg)
+        return (list(GetPage.objects.filter(name=name).values_list('modified', flat=True)),
+                _rows_validator(GetPageContent.objects.filter(page__name=name)))
+
+    def get_object(self, queryset=None):
+        slug = self.kwargs.get(self.slug_url_kwarg)
+        return cache.get_or_build('getpage:%s' % slug, self._load_object)
+
+    def _load_object(self):
+        page = super(GetPageView, self).get_object()
+        # load the entries and their maps with the page so rendering the
+        # template does not query per entry
+        page.entries = list(
+            page.published_entries().select_related('example_map'))
+        return page
+
+    def get_context_data(self, **kwargs):
+        ctx = super(GetPageView, self).get_context_data(**kwargs)
+        ctx['entries'] = self.object.entries
+        return ctx
+
+
+def _search_facets():
+    facets = dict(
+        regions=list(Region.objects.filter(level=1).values('code', 'name')),
+        categories=list(TopicCategory.objects.filter(is_choice=True)
+                        .values('identifier', 'gn_description')),
+    )
+    serialized = json.dumps(facets, sort_keys=True)
+    return dict(facets, json=serialized,
+                etag=hashlib.sha1(serialized).hexdigest())
+
+
+def search_facets():
+    return cache.get_or_build('search:facets', _search_facets, group='search')
+
+
+def _search_fragments(facets):
+    # the fragments are the same for every visitor, only the language varies
+    return dict(
+        (name, render_to_string('search/_%s.html' % name, {'regions': facets['regions']}))
+        for name in ('whats_hot', 'refine', 'sort_filters')
+    )
 
 
 class SearchView(TemplateView):
     template_name='search/searchn.html'
     def get_context_data(self, **kwargs):
         context = super(TemplateView, self).get_context_data(**kwargs)
-        context['regions'] = Region.objects.filter(level=1)
+        facets = search_facets()
+        context['regions'] = facets['regions']
+        context['search_fragments'] = cache.get_or_build(
+            'search:fragments:%s' % translation.get_language(),
+            lambda: _search_fragments(facets), group='search')
         return context
 
 
+@condition(etag_func=lambda request: search_facets()['etag'])
+def search_facets_json(request):
+    response = HttpResponse(search_facets()['json'], content_type='application/json')
+    # clients keep the facets and revalidate them with the etag
+    patch_cache_control(response, no_cache=True)
+    return response
+
+
 class ProfileDetail(DetailView):
     template_name = 'people/profile_detail.html'
     slug_field = 'username'
@@ -113,12 +353,81 @@ class ProfileDetail(DetailView):
 
     def get_context_data(self, **kwargs):
         ctx = super(ProfileDetail, self).get_context_data(**kwargs)
+        ctx['summary'] = profiles.summary(self.object, self.request.user)
         return ctx
 
 
-class LeaderListView(ListView):
+class LeaderListView(ConditionalMixin, ListView):
     context_object_name = 'leaders'
     model = Leader
+    validator_group = 'leaders'
+
+    def get_queryset(self):
+        return Leader.objects.select_related('user').prefetch_related('user__avatar_set')
+
+    def get_validator_name(self):
+        return 'leaders'
+
+    def get_validator(self):
+        return _rows_validator(Leader.objects.all())
+
+
+def search_content(request):
+    '''ranked JSON results of the full text search of the editorial content'''
+    query = request.GET.get('q', '')
+    try:
+        offset = max(0, int(request.GET.get('offset', 0)))
+        limit = min(100, max(1, int(request.GET.get('limit', 20))))
+    except ValueError:
+        return HttpResponseBadRequest('offset and limit must be numbers')
+    words = search.terms(query)
+    results = [dict(
+        type=doc.content_type.model,
+        id=doc.object_id,
+        title=doc.title,
+        snippet=search.snippet(doc.text, words),
+        url=doc.url,
+        date=doc.date.isoformat(),
+        rank=doc.rank,
+    ) for doc in search.search(query, offset, limit)]
+    return HttpResponse(json.dumps(dict(query=query, offset=offset, results=results)),
+                        content_type='application/json')
+
+
+def map_view(request, mapid, template='maps/mapstory_map_view.html'):
+    map_obj = _resolve_map(request, mapid, 'base.view_resourcebase', _PERMISSION_MSG_VIEW)
+    return render_to_response(template, RequestContext(request, {
+        'config': mapconfig.viewer_config(request.user, map_obj),
+        'map': map_obj,
+    }))
+
+
+def new_map(request, template='maps/mapstory_map_view.html'):
+    # copies of maps and maps of given layers are built by geonode
+    if request.method != 'GET' or 'copy' in request.GET or 'layer' in request.GET:
+        return geonode_new_map(request, template)
+    return render_to_response(template, RequestContext(request, {
+        'config': mapconfig.default_config(),
+    }))
+
+
+def story_frames(request, mapid):
+    '''stream the GetMap responses of every local layer of the map for
+    evenly spaced times between start and end as NDJSON'''
+    map_obj = _resolve_map(request, mapid, 'base.view_resourcebase', _PERMISSION_MSG_VIEW)
+    try:
+        times = playback.request_times(request.GET, playback.max_frames(request.user))
+        params = playback.getmap_params(request.GET)
+    except ValueError as e:
+        return HttpResponseBadRequest(str(e))
+    if not playback.allow(request):
+        return HttpResponse('Too many prefetches, try again in a minute',
+                            status=429, content_type='text/plain')
+    layers = [l for l in map_obj.layer_set.all() if l.local]
+    return StreamingHttpResponse(
+        playback.frames(layers, times, params, request.META.get('HTTP_COOKIE'),
+                        playback.public_layers(layers)),
+        content_type='application/x-ndjson')
 
 
 def test_view(req, template):
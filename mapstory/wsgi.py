@@ -23,6 +23,10 @@ os.environ.setdefault("DJANGO_SETTINGS_MODULE", "mapstory.settings")
 from django.core.wsgi import get_wsgi_application
 application = get_wsgi_application()
 
+# parse the templates now rather than in the first requests
+from mapstory import template_cache
+template_cache.warm()
+
 # Apply WSGI middleware here.
 # from helloworld.wsgi import HelloWorldApplication
 # application = HelloWorldApplication(application)
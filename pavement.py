@@ -68,6 +68,11 @@ def static():
         sh('grunt less')
 
 
+@task
+def check_templates():
+    sh('python manage.py check_templates')
+
+
 @task
 @needs('static')
 def collect_static():
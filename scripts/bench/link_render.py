@@ -0,0 +1,45 @@
+'''
+Micro-benchmark of mapstory.utils link rendering.
+
+Run from the project root:
+
+    python scripts/bench/link_render.py
+'''
+import os
+import sys
+import timeit
+
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../..')))
+
+from django.conf import settings
+settings.configure(STATIC_URL='/static/', INSTALLED_APPS=('django.contrib.staticfiles',))
+
+from mapstory.utils import Link
+from mapstory.utils import render_link
+
+LINKS = [
+    ('http://www.youtube.com/watch?v=abcdef', 'video', 400, 300),
+    ('https://youtu.be/abcdef', 'short video', 400, 300),
+    ('https://twitter.com/MapStory', 'twitter', 400, 300),
+    ('https://www.facebook.com/MapStory', 'facebook', 400, 300),
+    ('http://mapstory.org/static/img/logo.png', 'image', 400, 300),
+    ('http://mapstory.org/getskills', 'plain', 400, 300),
+]
+
+
+def uncached():
+    for href, name, width, height in LINKS:
+        Link(href, name).render(width, height)
+
+
+def cached():
+    for href, name, width, height in LINKS:
+        render_link(href, name, width, height)
+
+
+if __name__ == '__main__':
+    number = 20000
+    for fun in (uncached, cached):
+        total = min(timeit.repeat(fun, number=number, repeat=3))
+        print '%-10s %.2f usec per render' % (
+            fun.__name__, total / (number * len(LINKS)) * 1e6)
@@ -1,7 +1,4 @@
-from geonode.people.models import Profile
-from itertools import product
+import os
+from mapstory.seed import make_users
 
-names = product(['George', 'John', 'Tom', 'Jim', 'Andy'], ['Jackson', 'Adams', 'Monroe', 'Washington', 'Jefferson'])
-for first,last in names:
-    user = first + last
-    Profile.objects.create(username=user.lower(), first_name=first, last_name=last)
\ No newline at end of file
+make_users(int(os.environ.get('USERS', 25)))
@@ -2,4 +2,9 @@
 set -e
 . /home/mapstory/.virtualenvs/mapstory/bin/activate
 cd /srv/git/mapstory/mapstory-geonode
+# assemble the settings once, the workers load the dump. The directory is
+# only accessible by the app user (see admin.yml), and the workers assemble
+# the settings themselves if the dump cannot be written.
+export MAPSTORY_SETTINGS_CACHE=/srv/git/mapstory/mapstory-geonode/.settings-cache/settings.pickle
+python manage.py dump_settings || unset MAPSTORY_SETTINGS_CACHE
 exec python /usr/bin/gunicorn --pythonpath=. --workers=2 --bind=localhost:8000  --log-level=error mapstory.wsgi
\ No newline at end of file